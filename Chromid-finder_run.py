@@ -1,157 +1,96 @@
 import os
-import subprocess
+import sys
 import argparse
-import glob
-import shutil
-from multiprocessing import Pool
-from Bio import SeqIO
 
-# 定义脚本路径
-SCRIPT_0 = "scripts/part0.py"
-SCRIPT_1 = "scripts/part1.py"
-SCRIPT_2 = "scripts/part2.py"
-SCRIPT_3 = "scripts/part3.py"
-SCRIPT_4 = "scripts/part4.py"
-SCRIPT_5 = "scripts/part5.py"
+# 各阶段在进程内运行，见 scripts/pipeline.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+import pipeline
+import part1
+from stage_cache import parse_size
+from part5 import parse_thresholds
 
-# 生成gc.tsv文件
-def generate_gc_file(input_file):
-    command = f"seqkit fx2tab -l -g -n -i -H {input_file} > gc.tsv"
-    run_command(command)
-
-# 执行命令行命令
-def run_command(command):
-    print(f"Running command: {command}")
-    subprocess.run(command, shell=True, check=True)
-
-# 判断文件大小是否超过5GB
-def is_large_file(file_path, size_limit=5 * 1024**3):
-    return os.path.getsize(file_path) > size_limit
-
-# 调用part0.py
-def run_script_0(input_file, cpu):
-    command = f"python {SCRIPT_0} {input_file} {cpu}"
-    run_command(command)
-
-# 调用part1.py
-def run_script_1(input_file):
-    command = f"python {SCRIPT_1} {input_file}"
-    run_command(command)
-
-# 调用part2.py
-def run_script_2():
-    command = f"python {SCRIPT_2} "
-    run_command(command)
-
-# 调用part3.py
-def run_script_3(input_file, cpu):
-    command = f"python {SCRIPT_3} {input_file} part3.txt {cpu}"
-    run_command(command)
-
-# 调用part4.py
-def run_script_4():
-    command = f"python {SCRIPT_4} "
-    run_command(command)
-
-# 调用part5.py
-def run_script_5(output_file, cpu, dt):
-    command = f"python {SCRIPT_5} {output_file} {cpu} {dt}"
-    run_command(command)
-    
-
-
-# 删除不需要的文件和目录
-def clean_up_files(output_file, input_file):
-    current_directory = os.getcwd()
-
-    for item in os.listdir(current_directory):
-        item_path = os.path.join(current_directory, item)
-        # 排除 scripts 目录、databases 目录、Chromid-finder_run.py 脚本以及最终输出文件
-        if item in ["scripts", "databases", "Chromid-finder_run.py"] or item == output_file or item == input_file:
-            continue
-
-        if os.path.isfile(item_path):
-            os.remove(item_path)
-            print(f"Deleted file: {item_path}")
-        elif os.path.isdir(item_path):
-            shutil.rmtree(item_path)
-            print(f"Deleted directory and its contents: {item_path}")
-
-# 处理大文件的part1.py并行运行
-def process_large_file(input_file, cpu, output_file, dt):
-    # 首先运行part0.py
-    run_script_0(input_file, cpu)
-    
-    # 获取part0.py的输出文件
-    gpartfiles = glob.glob("g_part*.fasta")
-    print(f"gpartfiles: {gpartfiles}")
-    # 使用多进程并行调用part1.py
-    with Pool(cpu) as pool:
-        pool.map(run_script_1, gpartfiles)
-    
-    # 合并part1.py的输出文件
-    with open("part1.txt", "w") as part1:
-        for file in glob.glob("g_part*-part1.txt"):
-            with open(file, "r") as f:
-                shutil.copyfileobj(f, part1)
-
-    # 继续调用其他脚本
-    run_script_2()
-    run_script_3(input_file, cpu)
-    run_script_4()
-    run_script_5(output_file, cpu, dt)
-
-
-# 处理小文件的顺序运行
-def process_small_file(input_file, cpu, output_file, dt):
-    # 直接调用part1.py并重命名输出
-    run_script_1(input_file)
-
-    # 获取part1.py的输出文件，假设输出文件的格式为 "{input_file}-part1.txt"
-    output_1_file = f"{input_file}-part1.txt"
-    
-    # 检查文件是否存在
-    if os.path.exists(output_1_file):
-        # 重命名输出文件为 part1.txt
-        os.rename(output_1_file, "part1.txt")
-    else:
-        print(f"Error: Expected file {output_1_file} not found.")
-        return
-    
-    # 依次调用其他脚本
-    run_script_2()
-    run_script_3(input_file, cpu)
-    run_script_4()
-    run_script_5(output_file,cpu,dt)
 
 # 主函数逻辑
-def run_chromid_finder(input_file, cpu, output_file, dt):
-    # 生成gc.tsv文件
-    generate_gc_file(input_file)
-
-    # 判断文件大小
+# 中间文件只写入本次运行的工作目录，结束后只删除该目录，不再清理当前目录
+def run_chromid_finder(input_file, cpu, output_file, dt, **options):
+    """options are the keyword-only options of pipeline.run_pipeline()."""
+    pipeline.run_pipeline(input_file, cpu, output_file, dt, **options)
+    print("Process completed.")
 
-    if is_large_file(input_file):
-        print(f"Input file is large, size > 5GB. Running scripts with parallel processing.")
-        process_large_file(input_file, cpu, output_file, dt)
-    else:
-        print(f"Input file is small, size < 5GB. Running scripts sequentially.")
-        process_small_file(input_file, cpu, output_file, dt)
-    
-    # 清理中间文件
-    clean_up_files(output_file, input_file)
+# 批量模式：清单中的所有样本共用一个 CPU 预算，-o 为输出目录
+def run_chromid_finder_batch(manifest_file, cpu, output_dir, dt, parallel_samples=None, **options):
+    rows = pipeline.run_batch(manifest_file, cpu, output_dir, dt, parallel_samples, **options)
+    failed = [row[0] for row in rows if row[2] != "ok"]
+    if failed:
+        print(f"[Note] {len(failed)} of {len(rows)} samples failed: {', '.join(failed)}")
     print("Process completed.")
+    return not failed
 
 # 命令行解析函数
 def parse_args():
     parser = argparse.ArgumentParser(description="Run Chromid-finder pipeline")
-    parser.add_argument('-i', '--input', required=True, help="Input fasta file")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i', '--input', help="Input fasta file")
+    source.add_argument('--manifest', help="Batch mode: file listing one FASTA per line (optionally 'sample<TAB>path')")
     parser.add_argument('-n', '--cpu', type=int, required=True, help="Number of CPUs")
-    parser.add_argument('-o', '--output', required=True, help="Output file")
-    parser.add_argument('-d', '--dt', type=float, required=True, help="Parameter for dt")
-    return parser.parse_args()
+    parser.add_argument('-o', '--output', required=True, help="Output file (batch mode: output directory)")
+    parser.add_argument('-d', '--dt', type=parse_thresholds, required=True,
+                        help="Parameter for dt; a list (1,1.6,2) or range (1:2:0.2) scores every value in one pass, "
+                             "writing one output per value and a <output>.sweep.tsv summary")
+    parser.add_argument('-m', '--metric', choices=["legacy", "euclidean"], default="legacy",
+                        help="TNF distance: legacy (4-mers present in the chromosome only) or euclidean (all 256)")
+    parser.add_argument('-c', '--checkpoint-dir', default=None,
+                        help="Directory to keep intermediate files (part1.txt, part2.txt, part3.tnf, part4.npz)")
+    parser.add_argument('--combine-hmm', action='store_true',
+                        help="Concatenate the HMM profiles of each marker family into one hmmsearch pass")
+    parser.add_argument('-l', '--min-length', type=int, default=0,
+                        help="Skip contigs shorter than this (bp) before gene prediction (default: 0, keep all)")
+    parser.add_argument('--max-chromid-length', type=int, default=None,
+                        help="Drop candidates without dnaA longer than this (bp); they can only be chromosomes")
+    parser.add_argument('--backend', choices=part1.BACKENDS, default="subprocess",
+                        help="Gene prediction and marker search: external prodigal/hmmsearch/KofamScan (default) "
+                             "or in-process pyrodigal/pyhmmer (experimental)")
+    parser.add_argument('--staged-search', action='store_true',
+                        help="Search the core HMMs first; run the par, rep and dnaA searches only on contigs with a core hit")
+    parser.add_argument('--fused', action='store_true',
+                        help="Find and score each chromosome's GC window in one pass, without building cluster lists")
+    parser.add_argument('-w', '--work-dir', default=None,
+                        help="Directory under which each run creates its own scratch directory (default: system temp dir)")
+    parser.add_argument('--keep-work-dir', action='store_true',
+                        help="Do not delete the run's scratch directory at the end")
+    parser.add_argument('--tnf-index', action='store_true',
+                        help="With -m euclidean, prune candidates with an exact pivot radius index on the TNF vectors")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Cache stage outputs here, keyed by input/database hashes, so reruns skip completed stages")
+    parser.add_argument('--cache-size', type=parse_size, default=None,
+                        help="Evict least recently used cache entries beyond this size (e.g. 50G)")
+    parser.add_argument('--contig-cache', default=None,
+                        help="SQLite file caching marker hits and TNF vectors per contig sequence, "
+                             "so contigs seen in earlier runs skip gene prediction and the searches")
+    parser.add_argument('--contig-cache-size', type=parse_size, default=None,
+                        help="Evict least recently used contigs from the contig cache beyond this size (e.g. 5G)")
+    parser.add_argument('--parallel-samples', type=int, default=None,
+                        help="Batch mode: number of samples in flight at once (default: half the CPUs)")
+    args = parser.parse_args()
+    if args.manifest and len(args.dt) > 1:
+        parser.error("a -d sweep is not supported with --manifest")
+    if args.tnf_index and args.metric != "euclidean":
+        parser.error("--tnf-index requires -m euclidean")
+    try:
+        part1.check_backend(args.backend)
+    except ImportError as e:
+        parser.error(str(e))
+    return args
 
 # 主入口
 if __name__ == '__main__':
     args = parse_args()
-    run_chromid_finder(args.input, args.cpu, args.output, args.dt)
+    options = dict(metric=args.metric, use_index=args.tnf_index, fused=args.fused, checkpoint_dir=args.checkpoint_dir,
+                   scratch_dir=args.work_dir, keep_work_dir=args.keep_work_dir, combine_profiles=args.combine_hmm,
+                   staged_search=args.staged_search, backend=args.backend, min_length=args.min_length,
+                   max_chromid_length=args.max_chromid_length, cache_dir=args.cache_dir, cache_size=args.cache_size,
+                   contig_cache=args.contig_cache, contig_cache_size=args.contig_cache_size)
+    if args.manifest:
+        ok = run_chromid_finder_batch(args.manifest, args.cpu, args.output, args.dt, args.parallel_samples, **options)
+        sys.exit(0 if ok else 1)
+    run_chromid_finder(args.input, args.cpu, args.output, args.dt, **options)
@@ -0,0 +1,195 @@
+import os
+import time
+import sqlite3
+import hashlib
+import numpy as np
+
+import part1
+import part3
+import stage_cache
+
+# 按序列内容缓存每条 contig 的注释结果（SQLite）：标记基因命中与四联体向量。
+# 以序列哈希为键，因此不同组装中完全相同的 contig 可直接复用，与 contig 名称无关。
+# 命中记录按数据库版本（HMM/KofamScan 文件校验和 + 后端）区分，数据库更新后旧记录不再命中，
+# 并按最久未使用最先淘汰；四联体向量只依赖序列本身与四联体的计算方式（TNF_CACHE_VERSION）。
+# prodigal -p meta 逐条 contig 预测基因；使用该缓存时 hmmsearch 以 -Z 1 --domZ 1 运行（序列与结构域
+# E 值都不依赖搜索的目标数量），KofamScan 只比较得分，所以每条 contig 的命中与同一文件中的其它 contig 无关。
+# 默认运行的结构域 E 值使用 HMMER 默认的 domZ，因此缓存模式可能比默认运行多报告少量结构域。
+
+# 缓存表结构或命中语义变化时递增
+ANNOTATION_CACHE_VERSION = 2
+# 四联体向量的计算方式（part3 的计数、归一化或向量格式）变化时递增
+TNF_CACHE_VERSION = 1
+
+# 估算的每行存储字节数，用于容量控制
+HIT_BYTES = 48
+TNF_BYTES = 256 * 4 + 48
+CONTIG_BYTES = 96
+
+def open_cache(cache_file):
+    connection = sqlite3.connect(cache_file, timeout=120)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS contigs (
+            hash TEXT NOT NULL, version TEXT NOT NULL, last_used REAL NOT NULL, size INTEGER NOT NULL,
+            PRIMARY KEY (hash, version));
+        CREATE TABLE IF NOT EXISTS hits (
+            hash TEXT NOT NULL, version TEXT NOT NULL, gene_index INTEGER, family TEXT, score REAL);
+        CREATE INDEX IF NOT EXISTS hits_key ON hits (hash, version);
+    """)
+    # 旧版缓存的 tnf 表没有版本列，无法判断向量的计算方式，直接丢弃（之后重新计算）
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(tnf)")]
+    if columns and "version" not in columns:
+        with connection:
+            connection.execute("DROP TABLE tnf")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS tnf (
+            hash TEXT NOT NULL, version INTEGER NOT NULL, last_used REAL NOT NULL, vector BLOB NOT NULL,
+            PRIMARY KEY (hash, version))""")
+    return connection
+
+def annotation_version(combine_profiles=False, staged_search=False, backend="subprocess"):
+    """命中记录的版本：数据库文件内容、搜索方式与缓存格式的哈希"""
+    digests = (f"{os.path.basename(path)}:{stage_cache.file_digest(path)}" for path in stage_cache.database_files())
+    return stage_cache.stage_key("annotation", ANNOTATION_CACHE_VERSION, combine_profiles, staged_search, backend,
+                                 *digests)
+
+def sequence_hashes(input_file, index):
+    """{seq_id: 序列哈希}；哈希对去掉空白后的序列字节计算（区分大小写，与四联体统计一致）"""
+    return {seq_id: hashlib.blake2b(sequence, digest_size=16).hexdigest()
+            for seq_id, sequence in part3.iter_indexed_records(input_file, index)}
+
+def chunked(items, size=500):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def lookup_hits(connection, version, hashes):
+    """返回 {哈希: [(gene_index, family, score), ...]}，只包含已缓存的哈希（无命中的 contig 对应空列表）"""
+    cached = {}
+    for batch in chunked(set(hashes)):
+        marks = ",".join("?" * len(batch))
+        for (digest,) in connection.execute(
+                f"SELECT hash FROM contigs WHERE version = ? AND hash IN ({marks})", [version, *batch]):
+            cached[digest] = []
+        for digest, gene_index, family, score in connection.execute(
+                f"SELECT hash, gene_index, family, score FROM hits WHERE version = ? AND hash IN ({marks}) "
+                f"ORDER BY rowid", [version, *batch]):
+            cached[digest].append((gene_index, family, score))
+    with connection:
+        connection.executemany("UPDATE contigs SET last_used = ? WHERE hash = ? AND version = ?",
+                               [(time.time(), digest, version) for digest in cached])
+    return cached
+
+def store_hits(connection, version, hits_by_hash):
+    """保存新注释的 contig 的命中记录（hits_by_hash 中每个哈希都记为已注释，包括没有命中的）"""
+    now = time.time()
+    with connection:
+        for digest, hits in hits_by_hash.items():
+            connection.execute("DELETE FROM hits WHERE hash = ? AND version = ?", (digest, version))
+            connection.executemany("INSERT INTO hits VALUES (?, ?, ?, ?, ?)",
+                                   [(digest, version, *hit) for hit in hits])
+            connection.execute("INSERT OR REPLACE INTO contigs VALUES (?, ?, ?, ?)",
+                               (digest, version, now, CONTIG_BYTES + HIT_BYTES * len(hits)))
+
+def lookup_tnf(connection, hashes):
+    cached = {}
+    for batch in chunked(set(hashes)):
+        marks = ",".join("?" * len(batch))
+        for digest, vector in connection.execute(
+                f"SELECT hash, vector FROM tnf WHERE version = ? AND hash IN ({marks})", [TNF_CACHE_VERSION, *batch]):
+            cached[digest] = np.frombuffer(vector, dtype=np.float32)
+    with connection:
+        connection.executemany("UPDATE tnf SET last_used = ? WHERE hash = ? AND version = ?",
+                               [(time.time(), digest, TNF_CACHE_VERSION) for digest in cached])
+    return cached
+
+def store_tnf(connection, vectors):
+    now = time.time()
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO tnf VALUES (?, ?, ?, ?)",
+                               [(digest, TNF_CACHE_VERSION, now, np.asarray(vector, dtype=np.float32).tobytes())
+                                for digest, vector in vectors.items()])
+
+def evict(connection, max_bytes):
+    """
+    按最久未使用删除 contig 注释与四联体向量，直到估算总大小不超过 max_bytes。
+    删除后的空闲页会被之后的写入复用，所以文件大小也保持在该范围附近（不做 VACUUM）。
+    """
+    entries = [(last_used, size, "contigs", digest, version) for digest, version, last_used, size in
+               connection.execute("SELECT hash, version, last_used, size FROM contigs")]
+    entries += [(last_used, TNF_BYTES, "tnf", digest, version) for digest, version, last_used in
+                connection.execute("SELECT hash, version, last_used FROM tnf")]
+    total = sum(entry[1] for entry in entries)
+    removed = 0
+    with connection:
+        for _, size, table, digest, version in sorted(entries):
+            if total <= max_bytes:
+                break
+            if table == "contigs":
+                connection.execute("DELETE FROM contigs WHERE hash = ? AND version = ?", (digest, version))
+                connection.execute("DELETE FROM hits WHERE hash = ? AND version = ?", (digest, version))
+            else:
+                connection.execute("DELETE FROM tnf WHERE hash = ? AND version = ?", (digest, version))
+            total -= size
+            removed += 1
+    if removed:
+        print(f"[Note] Evicted {removed} annotation cache entries, about {total} bytes left")
+    return total
+
+def cached_annotation(cache_file, version, hashes, index, annotate, max_bytes=None):
+    """
+    标记基因命中：缓存命中的 contig 直接复用，只对未命中的 contig 调用 annotate(未命中的索引记录)。
+    hashes 为 sequence_hashes() 的结果；返回 Hit 列表（按标记家族、得分从高到低排列）。
+    """
+    connection = open_cache(cache_file)
+    try:
+        cached = lookup_hits(connection, version, (hashes[record.seq_id] for record in index))
+        # 同一序列在输入中出现多次时只注释一次
+        misses = list({hashes[record.seq_id]: record for record in reversed(index)
+                       if hashes[record.seq_id] not in cached}.values())[::-1]
+        print(f"[Note] Annotation cache: {len(index) - len(misses)} of {len(index)} contigs cached, "
+              f"{len(misses)} to annotate")
+
+        if misses:
+            new_hits = {hashes[record.seq_id]: [] for record in misses}
+            for hit in annotate(misses):
+                new_hits[hashes[hit.contig_id]].append((hit.gene_index, hit.family, hit.score))
+            store_hits(connection, version, new_hits)
+            cached.update(new_hits)
+        if max_bytes is not None:
+            evict(connection, max_bytes)
+    finally:
+        connection.close()
+
+    family_rank = {family: rank for rank, family in enumerate(["core", "par", "rep", "dnaa"])}
+    hits = [part1.Hit(record.seq_id, gene_index, family, score)
+            for record in index for gene_index, family, score in cached[hashes[record.seq_id]]]
+    hits.sort(key=lambda hit: (family_rank.get(hit.family, len(family_rank)), -hit.score))
+    return hits
+
+def cached_tnf(cache_file, hashes, candidates, compute, max_bytes=None):
+    """
+    候选序列的四联体矩阵：缓存中已有的向量直接读取，其余调用 compute(序列ID集合) -> (ids, matrix)
+    计算后写入缓存。返回 (ids, matrix)，顺序与 compute 对全部候选序列的结果一致（按输入文件顺序）。
+    """
+    ordered = [seq_id for seq_id in hashes if seq_id in candidates]
+    connection = open_cache(cache_file)
+    try:
+        vectors = lookup_tnf(connection, (hashes[seq_id] for seq_id in ordered))
+        missing = {seq_id for seq_id in ordered if hashes[seq_id] not in vectors}
+        if missing:
+            ids, matrix = compute(missing)
+            computed = {hashes[seq_id]: matrix[row] for row, seq_id in enumerate(ids)}
+            store_tnf(connection, computed)
+            vectors.update(computed)
+        if max_bytes is not None:
+            evict(connection, max_bytes)
+    finally:
+        connection.close()
+
+    ids = [seq_id for seq_id in ordered if hashes[seq_id] in vectors]
+    matrix = np.zeros((len(ids), 256), dtype=np.float32)
+    for row, seq_id in enumerate(ids):
+        matrix[row] = vectors[hashes[seq_id]]
+    print(f"[Note] Annotation cache: {len(ordered) - len(missing)} of {len(ordered)} TNF vectors cached")
+    return ids, matrix
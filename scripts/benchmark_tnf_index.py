@@ -0,0 +1,92 @@
+"""
+Benchmark of the part5 pivot radius index against brute-force euclidean scoring.
+
+For growing candidate set sizes, every query (chromosome) row is scored against
+all candidate rows, once by brute force (calculate_cluster_distances) and once
+after pruning with the pivot index (radius_prefilter). The pass sets are
+checked to be identical, and the crossover size, the smallest one at which the
+index is faster, is reported.
+
+Usage: python benchmark_tnf_index.py <dt> [part3.tnf] [queries]
+
+Without a TNF store, synthetic relative-abundance vectors are drawn around a few
+hundred "genome" centres, which mimics the clumpy TNF space of a metagenome.
+"""
+import sys
+import time
+import numpy as np
+
+from part3 import load_tnf_store
+from part5 import PIVOT_COUNT, build_pivot_index, calculate_cluster_distances, radius_prefilter
+
+
+def synthetic_tnf(num_rows, num_genomes=300, num_factors=8, seed=0):
+    """
+    Relative abundance vectors (values around 1): genome centres vary along a few
+    latent factors, as real TNF profiles do (GC content dominates), and contigs
+    scatter around their genome's centre.
+    """
+    rng = np.random.default_rng(seed)
+    loadings = rng.normal(0, 0.3 / np.sqrt(num_factors), (num_factors, 256))
+    centres = 1 + rng.normal(0, 1, (num_genomes, num_factors)) @ loadings
+    rows = centres[rng.integers(num_genomes, size=num_rows)] + rng.normal(0, 0.03, (num_rows, 256))
+    return np.clip(rows, 0, None).astype(np.float32)
+
+
+def brute_force(matrix, queries, candidates, dt):
+    return [candidates[calculate_cluster_distances(matrix, query, candidates, 'euclidean') <= dt] for query in queries]
+
+
+def indexed(matrix, pivot_index, queries, candidates, dt):
+    passed = []
+    for query in queries:
+        members = candidates[radius_prefilter(pivot_index, query, candidates, dt)]
+        passed.append(members[calculate_cluster_distances(matrix, query, members, 'euclidean') <= dt])
+    return passed
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(dt, tnf_file=None, num_queries=100):
+    matrix = load_tnf_store(tnf_file)[1] if tnf_file else synthetic_tnf(100000)
+    rng = np.random.default_rng(1)
+    queries = rng.choice(len(matrix), size=min(num_queries, len(matrix)), replace=False)
+
+    pivot_index, build_seconds = timed(build_pivot_index, matrix)
+    print(f"{len(matrix)} TNF vectors, {len(queries)} queries, dt={dt}, "
+          f"{PIVOT_COUNT} pivots built in {build_seconds:.2f}s")
+    print("candidates\tbrute_s\tindex_s\tspeedup\tverified/query\tpassed/query")
+
+    crossover = None
+    sizes = [size for size in (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000) if size <= len(matrix)]
+    for size in sizes:
+        candidates = np.sort(rng.choice(len(matrix), size=size, replace=False))
+        brute, brute_seconds = timed(brute_force, matrix, queries, candidates, dt)
+        pruned, index_seconds = timed(indexed, matrix, pivot_index, queries, candidates, dt)
+        if any(not np.array_equal(a, b) for a, b in zip(brute, pruned)):
+            raise RuntimeError(f"Index and brute force disagree at {size} candidates")
+
+        verified = np.mean([radius_prefilter(pivot_index, query, candidates, dt).sum() for query in queries])
+        passed = np.mean([len(members) for members in brute])
+        print(f"{size}\t{brute_seconds:.3f}\t{index_seconds:.3f}\t{brute_seconds / index_seconds:.2f}\t"
+              f"{verified:.1f}\t{passed:.1f}")
+        if crossover is None and index_seconds < brute_seconds:
+            crossover = size
+
+    if crossover is None:
+        print("[Note] The index was not faster at any tested size")
+    else:
+        print(f"[Note] The index is faster from about {crossover} candidates per chromosome")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python benchmark_tnf_index.py <dt> [part3.tnf] [queries]")
+        sys.exit(1)
+
+    main(float(sys.argv[1]), sys.argv[2] if len(sys.argv) >= 3 else None,
+         int(sys.argv[3]) if len(sys.argv) == 4 else 100)
@@ -1,71 +1,253 @@
 import os
 import sys
 import math
-from multiprocessing import Process
-
-def build_index(input_file):
-    """构建索引：记录每个记录的起始位置和长度（内存友好）"""
-    index = []
-    with open(input_file, 'rb') as f:
-        pos = 0
-        while True:
-            line = f.readline()
-            if not line:
-                break
-            if line.startswith(b'>'):
-                start = pos
-                # 读取整个记录直到下一个'>'
-                while True:
-                    pos = f.tell()
-                    next_line = f.readline()
-                    if not next_line or next_line.startswith(b'>'):
-                        break
-                index.append((start, pos - start))
-                if next_line:
-                    f.seek(pos)  # 回退到上一个位置
-            else:
-                pos = f.tell()
+import mmap
+import heapq
+import tempfile
+from collections import namedtuple
+import numpy as np
+import multiprocessing
+
+# 索引记录：记录起始偏移、记录字节数（含标题行）、序列ID、序列长度（不含空白）、G+C 数（不区分大小写）
+IndexRecord = namedtuple('IndexRecord', ['offset', 'size', 'seq_id', 'seq_length', 'gc_count'])
+
+INDEX_SUFFIX = ".cfi"
+INDEX_MAGIC = "#chromid-finder-index"
+
+def find_records(mm, block_size):
+    """第一遍：按块找出每条记录的起始位置（行首的 '>'）和标题行末尾的换行位置"""
+    size = len(mm)
+    starts, header_ends = [], []
+    prev_byte = 10  # 文件开头视为行首
+    for block_start in range(0, size, block_size):
+        block = np.frombuffer(mm[block_start:block_start + block_size], dtype=np.uint8)
+        gt = np.flatnonzero(block == 62)
+        before = np.where(gt > 0, block[gt - 1], prev_byte)
+        record_starts = gt[before == 10] + block_start
+
+        newlines = np.flatnonzero(block == 10) + block_start
+        pos = np.searchsorted(newlines, record_starts)
+        ends = newlines[np.minimum(pos, len(newlines) - 1)] if len(newlines) else np.full(len(record_starts), -1)
+        ends = np.where(pos < len(newlines), ends, -1)
+        # 标题行跨块时单独查找
+        for i in np.flatnonzero(ends < 0):
+            header_end = mm.find(b'\n', int(record_starts[i]))
+            ends[i] = size if header_end == -1 else header_end
+
+        starts.append(record_starts)
+        header_ends.append(ends)
+        prev_byte = block[-1]
+    if not starts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(starts).astype(np.int64), np.concatenate(header_ends).astype(np.int64)
+
+# 每个字节为 0/1 的 uint64 字乘以该常数后，最高字节即为 8 个字节之和
+BYTE_SUM = np.uint64(0x0101010101010101)
+
+def mask_prefix_counts(mask, offsets):
+    """mask 为长度是 8 的倍数的 bool 数组，返回 mask[:offset] 中 True 的个数（按 8 字节字计数）"""
+    words = mask.view(np.uint64)
+    cum_words = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum((words * BYTE_SUM) >> np.uint64(56), out=cum_words[1:])
+
+    word_index = offsets // 8
+    partial = words[np.minimum(word_index, len(words) - 1)] if len(words) else np.zeros(len(offsets), dtype=np.uint64)
+    keep = (np.uint64(1) << ((offsets % 8) * 8).astype(np.uint64)) - np.uint64(1)
+    return cum_words[word_index] + (((partial & keep) * BYTE_SUM) >> np.uint64(56)).astype(np.int64)
+
+def prefix_counts(mm, points, block_size):
+    """第二遍：对升序位置 points 计算其之前的序列字节数（不计空白/控制字符）与 G+C 数（不区分大小写）"""
+    lengths = np.zeros(len(points), dtype=np.int64)
+    gcs = np.zeros(len(points), dtype=np.int64)
+    carry_length, carry_gc, k = 0, 0, 0
+    for block_start in range(0, len(mm), block_size):
+        data = mm[block_start:block_start + block_size]
+        block = np.zeros(-(-len(data) // 8) * 8, dtype=np.uint8)  # 补零到 8 字节对齐，补位不计数
+        block[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        length_mask = block > 32
+        # 屏蔽 0x04 与 0x20 两位后，C/G/c/g 均为 0x43
+        gc_mask = (block & 0xDB) == 0x43
+
+        hi = np.searchsorted(points, block_start + len(data), side='right')
+        offsets = points[k:hi] - block_start
+        lengths[k:hi] = carry_length + mask_prefix_counts(length_mask, offsets)
+        gcs[k:hi] = carry_gc + mask_prefix_counts(gc_mask, offsets)
+
+        carry_length += int(np.count_nonzero(length_mask))
+        carry_gc += int(np.count_nonzero(gc_mask))
+        k = hi
+    return lengths, gcs
+
+def scan_index(input_file, block_size=8 * 1024**2):
+    """内存映射整个文件，按块扫描记录边界，并统计每条记录的序列长度与 G+C 数"""
+    if os.path.getsize(input_file) == 0:
+        return []
+
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        starts, header_ends = find_records(mm, block_size)
+        ends = np.append(starts[1:], size)
+        seq_starts = np.minimum(header_ends + 1, ends)
+
+        # 序列区间为 [标题行末尾+1, 下一条记录起点)
+        points = np.empty(2 * len(starts), dtype=np.int64)
+        points[0::2] = seq_starts
+        points[1::2] = ends
+        lengths, gcs = prefix_counts(mm, points, block_size)
+        seq_lengths = lengths[1::2] - lengths[0::2]
+        gc_counts = gcs[1::2] - gcs[0::2]
+
+        index = []
+        for start, header_end, end, seq_length, gc_count in zip(
+                starts.tolist(), header_ends.tolist(), ends.tolist(), seq_lengths.tolist(), gc_counts.tolist()):
+            fields = mm[start + 1:header_end].split(None, 1)
+            seq_id = fields[0].decode() if fields else ''
+            index.append(IndexRecord(start, end - start, seq_id, seq_length, gc_count))
     return index
 
-def split_faa(input_file, output_prefix, num_parts, num_processes):
+def index_file(input_file):
+    return f"{input_file}{INDEX_SUFFIX}"
+
+def index_key(input_file):
+    stat = os.stat(input_file)
+    return f"{INDEX_MAGIC}\t{stat.st_size}\t{stat.st_mtime_ns}"
+
+def load_index(input_file):
+    """读取已保存的索引；输入文件的大小或修改时间变化时返回 None"""
+    try:
+        with open(index_file(input_file), 'r') as f:
+            if f.readline().rstrip('\n') != index_key(input_file):
+                return None
+            index = []
+            for line in f:
+                seq_id, offset, size, seq_length, gc_count = line.rstrip('\n').split('\t')
+                index.append(IndexRecord(int(offset), int(size), seq_id, int(seq_length), int(gc_count)))
+            return index
+    except (OSError, ValueError):
+        return None
+
+def save_index(input_file, index):
+    """把索引保存到输入文件旁（<input_file>.cfi），先写临时文件再替换"""
+    # 临时文件名唯一（同一进程内的多个线程也不会冲突）
+    temp_file = None
+    try:
+        fd, temp_file = tempfile.mkstemp(prefix=f".{os.path.basename(index_file(input_file))}.", suffix=".tmp",
+                                         dir=os.path.dirname(os.path.abspath(index_file(input_file))))
+        with os.fdopen(fd, 'w') as f:
+            f.write(index_key(input_file) + "\n")
+            for record in index:
+                f.write(f"{record.seq_id}\t{record.offset}\t{record.size}\t{record.seq_length}\t{record.gc_count}\n")
+        os.replace(temp_file, index_file(input_file))
+    except OSError as e:
+        print(f"[Note] Could not save FASTA index for {input_file}: {e}")
+        if temp_file is not None and os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def build_index(input_file, persist=True):
+    """构建索引：每个记录的起始位置、字节数、ID、序列长度和G+C数；优先复用已保存的索引"""
+    index = load_index(input_file) if persist else None
+    if index is not None:
+        print(f"[Note] Loaded FASTA index {index_file(input_file)} ({len(index)} records)")
+        return index
+
+    index = scan_index(input_file)
+    if persist:
+        save_index(input_file, index)
+    return index
+
+def filter_index(index, min_length=0):
+    """按最短序列长度过滤索引记录（不含标题行与空白），并报告跳过的记录数与碱基数"""
+    kept = [record for record in index if record.seq_length >= min_length]
+    total_bases = sum(record.seq_length for record in index)
+    kept_bases = sum(record.seq_length for record in kept)
+    print(f"[Note] Length filter (>= {min_length} bp): skipped {len(index) - len(kept)} of {len(index)} contigs, "
+          f"{total_bases - kept_bases} of {total_bases} bases")
+    return kept
+
+def gc_columns(index):
+    """
+    由索引生成 id/length/GC 列。GC 与 seqkit fx2tab -g 的定义相同：G+C（不区分大小写）
+    占序列长度的百分比，按 %.2f 舍入；空序列为 NaN。
+    """
+    ids = np.array([record.seq_id for record in index], dtype=str)
+    lengths = np.array([record.seq_length for record in index], dtype=np.int64)
+    gc = np.array([float(f"{record.gc_count / record.seq_length * 100:.2f}") if record.seq_length else np.nan
+                   for record in index], dtype=np.float64)
+    return {'id': ids, 'length': lengths, 'GC': gc}
+
+def write_gc_table(columns, gc_file):
+    """以 .npz 列存格式保存 GC 表"""
+    with open(gc_file, 'wb') as f:
+        np.savez(f, **columns)
+    return gc_file
+
+def assign_parts(index, num_parts):
+    """
+    按序列量装箱：记录按长度从大到小依次放入当前总量最小的part（贪心最长优先），
+    使每个part的序列量大致相同。各part内记录保持原文件顺序。
+    """
+    heap = [(0, part) for part in range(num_parts)]
+    parts = [[] for _ in range(num_parts)]
+    for rec_id in sorted(range(len(index)), key=lambda i: index[i].size, reverse=True):
+        size, part = heapq.heappop(heap)
+        parts[part].append(rec_id)
+        heapq.heappush(heap, (size + index[rec_id].size, part))
+    return [sorted(rec_ids) for rec_ids in parts]
+
+def report_parts(index, parts):
+    """输出各part的记录数与序列量分布"""
+    sizes = [sum(index[rec_id].size for rec_id in rec_ids) for rec_ids in parts]
+    for part_num, (rec_ids, size) in enumerate(zip(parts, sizes), start=1):
+        print(f"[Note] part{part_num}: {len(rec_ids)} records, {size} bytes")
+    mean_size = sum(sizes) / len(sizes) if sizes else 0
+    if mean_size:
+        print(f"[Note] Shard sizes: min {min(sizes)}, max {max(sizes)}, max/mean {max(sizes) / mean_size:.3f}")
+
+def split_faa(input_file, output_prefix, num_parts, num_processes, index=None, mp_context=None):
+    """
+    拆分 FASTA，返回非空分片文件路径列表（按编号排序）；给出 index 时只写出其中的记录。
+    mp_context 为创建子进程使用的 multiprocessing 上下文（默认为平台默认方式）
+    """
     # 1. 构建索引（单次遍历）
-    index = build_index(input_file)
-    total_records = len(index)
-    
-    # 2. 分配记录到不同part
-    records_per_part = math.ceil(total_records / num_parts)
-    
+    if index is None:
+        index = build_index(input_file)
+
+    # 2. 按序列量分配记录到不同part
+    parts = assign_parts(index, num_parts)
+    report_parts(index, parts)
+    jobs = [(part_num, rec_ids) for part_num, rec_ids in enumerate(parts, start=1) if rec_ids]
+
     # 3. 启动多进程处理
     processes = []
-    part_per_process = math.ceil(num_parts / num_processes)
-    
+    jobs_per_process = math.ceil(len(jobs) / num_processes)
+
     for proc_id in range(num_processes):
-        start_part = proc_id * part_per_process
-        end_part = min((proc_id + 1) * part_per_process, num_parts)
-        p = Process(
+        proc_jobs = jobs[proc_id * jobs_per_process:(proc_id + 1) * jobs_per_process]
+        if not proc_jobs:
+            continue
+        p = (mp_context or multiprocessing).Process(
             target=process_part,
-            args=(input_file, output_prefix, index, 
-                 start_part + 1, end_part, records_per_part)
+            args=(input_file, output_prefix, index, proc_jobs)
         )
         p.start()
         processes.append(p)
-    
+
     for p in processes:
         p.join()
 
-def process_part(input_file, output_prefix, index, start_part, end_part, records_per_part):
-    """处理指定范围的part"""
+    return [f"{output_prefix}_part{part_num}.fasta" for part_num, _ in jobs]
+
+def process_part(input_file, output_prefix, index, jobs):
+    """处理指定的part：jobs 为 [(part_num, 记录编号列表), ...]"""
     with open(input_file, 'rb') as src_f:
-        for part_num in range(start_part, end_part + 1):
+        for part_num, rec_ids in jobs:
             output_file = f"{output_prefix}_part{part_num}.fasta"
-            start_idx = (part_num - 1) * records_per_part
-            end_idx = min(part_num * records_per_part, len(index))
-            
+
             with open(output_file, 'wb') as dst_f:
-                for rec_id in range(start_idx, end_idx):
-                    start_pos, length = index[rec_id]
-                    src_f.seek(start_pos)
-                    dst_f.write(src_f.read(length))
+                for rec_id in rec_ids:
+                    record = index[rec_id]
+                    src_f.seek(record.offset)
+                    dst_f.write(src_f.read(record.size))
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
@@ -1,6 +1,23 @@
 import subprocess
 import sys
-from pathlib import Path
+import os
+import time
+import shutil
+import threading
+import itertools
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import part0
+import part3
+
+# 可选依赖：仅 pyhmmer 后端（进程内基因预测与 HMM 搜索）需要
+try:
+    import pyrodigal
+    import pyhmmer
+except ImportError:
+    pyrodigal = pyhmmer = None
 
 def execute_command(command):
     """Executes a shell command and handles errors."""
@@ -10,100 +27,466 @@ def execute_command(command):
         print(f"Error executing command: {command}\n{e}")
         sys.exit(1)
 
-def read_lines(file_path):
-    """Reads all lines from a file."""
+# One marker hit: contig ID, gene index within the contig (prodigal's "<contig>_<n>"), marker family, bit score
+Hit = namedtuple("Hit", ["contig_id", "gene_index", "family", "score"])
+
+def parse_protein_id(protein_id):
+    """Splits a prodigal protein ID "<contig>_<n>" into (contig, n)."""
+    contig_id, _, gene = protein_id.rpartition("_")
+    if not contig_id or not gene.isdigit():
+        return protein_id, 0
+    return contig_id, int(gene)
+
+def iter_domtblout_hits(file_path, family, threshold=30, score_index=7):
+    """Streams hmmsearch --domtblout rows whose full-sequence score passes threshold."""
+    with open(file_path, "r") as file:
+        for line in file:
+            if line.startswith("#"):
+                continue
+            columns = line.split()
+            if len(columns) <= score_index:
+                continue
+            try:
+                score = float(columns[score_index])
+            except ValueError:
+                continue
+            if score >= threshold:
+                yield Hit(*parse_protein_id(columns[0]), family, score)
+
+def iter_kofam_hits(file_path, threshold=100):
+    """
+    Streams KofamScan "-f detail" rows whose score passes threshold. Rows above the KO's
+    own threshold start with "*", which shifts the score from column 3 to column 4.
+    """
+    with open(file_path, "r") as file:
+        for line in file:
+            if line.startswith("#"):
+                continue
+            columns = line.split()
+            score_index = 4 if line.startswith("*") else 3
+            if len(columns) <= score_index:
+                continue
+            try:
+                score = float(columns[score_index])
+            except ValueError:
+                continue
+            if score >= threshold:
+                yield Hit(*parse_protein_id(columns[score_index - 3]), "dnaa", score)
+
+def format_hit(hit):
+    return f"{hit.contig_id}\t{hit.gene_index}\t{hit.family}\t{hit.score}\n"
+
+def write_hits(hits, output_file):
+    """Writes hit records as tab-separated contig, gene index, family, score."""
+    with open(output_file, "w") as file:
+        for hit in hits:
+            file.write(format_hit(hit))
+
+def record_hits(hits, output_file):
+    """Passes hits through unchanged while writing them to output_file."""
+    with open(output_file, "w") as file:
+        for hit in hits:
+            file.write(format_hit(hit))
+            yield hit
+
+def read_hits(input_file):
+    """Streams hit records written by write_hits."""
     try:
-        with open(file_path, "r") as file:
-            return file.readlines()
+        with open(input_file, "r") as file:
+            for line in file:
+                columns = line.rstrip("\n").split("\t")
+                if len(columns) == 4:
+                    yield Hit(columns[0], int(columns[1]), columns[2], float(columns[3]))
     except FileNotFoundError:
-        print(f"File not found: {file_path}")
+        print(f"File not found: {input_file}")
         sys.exit(1)
 
-def write_lines(file_path, lines, mode="a"):
-    """Writes lines to a file."""
-    with open(file_path, mode) as file:
-        file.writelines(lines)
-
-def filter_lines(lines, prefix, score_index, threshold, alt_score_index=None):
-    """Filters lines based on score and prefix rules."""
-    filtered_lines = []
-    for line in lines:
-        if line.startswith("#"):
-            filtered_lines.append(line)
+# 数据库目录（仓库内的 databases/），与当前工作目录无关
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "databases")
+
+def database_file(name):
+    return os.path.join(DATABASE_DIR, name)
+
+def work_prefix(input_file, work_dir=None):
+    """Path prefix for the intermediate files of input_file: next to it, or inside work_dir."""
+    return os.path.join(work_dir, os.path.basename(input_file)) if work_dir else input_file
+
+# Marker families and the HMM profiles searched for each of them
+MARKER_PROFILES = [
+    ("core", ["core1", "core2"]),
+    ("par", ["par1", "par2"]),
+    ("rep", ["rep1", "rep2"]),
+]
+
+def hmmsearch_command(hmm_file, domtblout, faa_file, dom_z=None):
+    """
+    Returns an hmmsearch command with a {threads} placeholder. -Z 1 fixes the sequence E-value
+    database size; domain E-values use HMMER's default domZ (the number of significant targets)
+    unless dom_z is given. dom_z=1 makes the hits of a protein independent of which other
+    proteins are searched with it (used by --staged-search and the per-contig annotation cache).
+    """
+    dom_z_option = f" --domZ {dom_z}" if dom_z is not None else ""
+    return (f"hmmsearch -Z 1{dom_z_option} --noali --domE 1e-5 --cpu {{threads}} --domtblout {domtblout} "
+            f"{hmm_file} {faa_file}")
+
+# 共享线程预算：批量模式下多个样本的外部程序共用同一 CPU 预算（见 pipeline.run_batch）
+# mp_context 为各阶段进程池使用的 multiprocessing 上下文：样本以线程并发运行时不能直接 fork
+def make_budget(cpu, stage_cpu=None, mp_context=None):
+    return {'total': cpu, 'free': cpu, 'stage_cpu': stage_cpu or cpu, 'condition': threading.Condition(),
+            'mp_context': mp_context}
+
+def budget_mp_context(budget):
+    return budget['mp_context'] if budget else None
+
+@contextmanager
+def reserved_threads(budget, threads):
+    """Blocks until threads are free in the shared budget and holds them for the block; no-op without a budget."""
+    if budget is None:
+        yield
+        return
+    threads = min(threads, budget['total'])
+    with budget['condition']:
+        budget['condition'].wait_for(lambda: budget['free'] >= threads)
+        budget['free'] -= threads
+    try:
+        yield
+    finally:
+        with budget['condition']:
+            budget['free'] += threads
+            budget['condition'].notify_all()
+
+def run_timed(name, command, threads=1, budget=None):
+    """Runs one command (holding threads from budget) and returns (name, wall time in seconds)."""
+    with reserved_threads(budget, threads):
+        start = time.perf_counter()
+        execute_command(command)
+        return name, time.perf_counter() - start
+
+def run_concurrently(jobs, cpu, budget=None, threads=None):
+    """
+    Runs independent (name, command) jobs concurrently within a total budget of cpu threads.
+    Each command may contain a {threads} placeholder for its share of the budget; pass
+    threads to fix the per-job count instead (e.g. 1 for single-threaded programs).
+    With a shared budget, every job waits for its threads there, so jobs of other
+    samples interleave with these. Returns {name: wall time in seconds}.
+    """
+    threads = threads or max(1, cpu // len(jobs))
+    if budget:
+        workers = len(jobs)
+        print(f"[Note] Queueing {len(jobs)} jobs with {threads} threads each on the shared budget")
+    else:
+        workers = max(1, min(len(jobs), cpu // threads))
+        print(f"[Note] Running {len(jobs)} jobs, {workers} at a time with {threads} threads each")
+
+    timings = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_timed, name, command.format(threads=threads), threads, budget)
+                   for name, command in jobs]
+        for future in as_completed(futures):
+            name, seconds = future.result()
+            timings[name] = seconds
+            print(f"[Note] {name} finished in {seconds:.1f}s")
+    return timings
+
+# prodigal 单线程运行；小于该大小的输入不值得再拆分出一个分片
+PRODIGAL_SHARD_BYTES = 4 * 1024**2
+
+def choose_shard_count(total_bytes, cpu, min_shard_bytes=PRODIGAL_SHARD_BYTES):
+    """Number of prodigal shards: one per core, but no shard smaller than min_shard_bytes."""
+    return max(1, min(cpu, total_bytes // min_shard_bytes))
+
+def predict_genes(input_file, faa_file, cpu, work_dir=None, budget=None, index=None):
+    """
+    Runs prodigal -p meta on size-balanced contig shards in parallel and merges the
+    proteins into faa_file in shard order. Gene prediction in meta mode is per contig,
+    so protein IDs (<contig>_<n>) are the same as for a single prodigal run.
+    With index (e.g. from part0.filter_index), only those records are written to the shards.
+    """
+    total_bytes = os.path.getsize(input_file) if index is None else sum(record.size for record in index)
+    num_shards = choose_shard_count(total_bytes, cpu)
+    if num_shards == 1 and index is None:
+        _, seconds = run_timed("prodigal", f"prodigal -i {input_file} -a {faa_file} -p meta", 1, budget)
+        print(f"[Note] prodigal finished in {seconds:.1f}s")
+        return
+
+    shards = part0.split_faa(input_file, f"{work_prefix(input_file, work_dir)}.prodigal", num_shards, num_shards, index,
+                             budget_mp_context(budget))
+    if not shards:
+        open(faa_file, "wb").close()
+        return
+    jobs = [(f"prodigal {shard}", f"prodigal -i {shard} -a {shard}.faa -p meta") for shard in shards]
+    # prodigal 是单线程程序，每个分片只占用一个线程
+    run_concurrently(jobs, cpu, budget, threads=1)
+
+    with open(faa_file, "wb") as merged:
+        for shard in shards:
+            with open(f"{shard}.faa", "rb") as f:
+                shutil.copyfileobj(f, merged)
+
+def combine_hmm_files(hmm_files, output_file):
+    """
+    Concatenates HMM files into output_file. Some bundled profiles (par1, rep1) lack a final
+    newline, so one is added where missing; otherwise the next profile's header would follow
+    the closing "//" on the same line and hmmsearch would reject the file.
+    """
+    with open(output_file, "wb") as out:
+        for hmm_file in hmm_files:
+            with open(hmm_file, "rb") as f:
+                data = f.read()
+            out.write(data if data.endswith(b"\n") else data + b"\n")
+    return output_file
+
+def search_jobs(families, faa_file, prefix, combine_profiles=False, dom_z=None):
+    """hmmsearch jobs for the given marker families; returns (jobs, [(domtblout, family), ...])."""
+    jobs = []
+    search_outputs = []
+    for family, profiles in MARKER_PROFILES:
+        if family not in families:
             continue
+        if combine_profiles:
+            combined_hmm = combine_hmm_files([database_file(f"{profile}.hmm") for profile in profiles],
+                                             f"{prefix}-{family}.hmm")
+            output = f"{prefix}-{family}.out"
+            jobs.append((family, hmmsearch_command(combined_hmm, output, faa_file, dom_z)))
+            search_outputs.append((output, family))
+        else:
+            for profile in profiles:
+                output = f"{prefix}-{profile}.out"
+                jobs.append((profile, hmmsearch_command(database_file(f"{profile}.hmm"), output, faa_file, dom_z)))
+                search_outputs.append((output, family))
+    return jobs, search_outputs
 
-        columns = line.split()
-        if alt_score_index is not None and line.startswith("*"):
-            score_index = alt_score_index
+def kofam_job(faa_file, prefix):
+    """KofamScan dnaA job; returns (job, output file)."""
+    dnaA_file = f"{prefix}-dnaA.tsv"
+    return ("dnaA", f"exec_annotation -o {dnaA_file} -p {database_file('dnaa.hal')} -k {database_file('ko_list')} "
+                    f"--cpu {{threads}} --tmp-dir {prefix}-kofam_tmp -f detail {faa_file}"), dnaA_file
 
-        try:
-            if len(columns) > score_index and float(columns[score_index]) >= threshold:
-                filtered_lines.append(f"{prefix}_{line}")
-        except ValueError:
-            filtered_lines.append(f"{prefix}_{line}")
+def filter_proteins(faa_file, contig_ids, output_file):
+    """Copies the proteins of the given contigs to output_file; returns the number copied."""
+    count = 0
+    keep = False
+    with open(faa_file, "r") as src, open(output_file, "w") as dst:
+        for line in src:
+            if line.startswith(">"):
+                keep = parse_protein_id(line[1:].split(None, 1)[0])[0] in contig_ids
+                count += keep
+            if keep:
+                dst.write(line)
+    return count
 
-    return filtered_lines
+def annotate(input_file, cpu=2, combine_profiles=False, work_dir=None, budget=None, staged=False, index=None,
+             backend="subprocess", fixed_domz=False):
+    """
+    Runs gene prediction and marker searches on input_file and returns an iterator of Hit records.
 
-def process_file(file_path, output_file, prefix, score_index, threshold=30, alt_score_index=None):
-    """Filters and writes data from an input file to an output file."""
-    lines = read_lines(file_path)
-    filtered_lines = filter_lines(lines, prefix, score_index, threshold, alt_score_index)
-    write_lines(output_file, filtered_lines)
+    The hmmsearch and KofamScan jobs are independent and run concurrently within cpu threads.
+    With combine_profiles, the profiles of each marker family are concatenated and searched
+    in a single hmmsearch pass. Intermediate files go to work_dir (default: next to input_file).
 
-def main(input_file):
-    # Define commands
-    commands = [
-        f"prodigal -i {input_file} -a {input_file}.faa -p meta",
+    With staged, the core profiles are searched first and the par, rep and dnaA searches only
+    see the proteins of contigs with a core hit; part2 drops every other contig anyway. Staged
+    searches run with domZ fixed to 1, since the default domZ would change with the smaller
+    target set; fixed_domz does the same for a plain search (per-contig annotation cache).
+    Either can report slightly more domains than a default run.
 
-        f"hmmsearch -Z 1 --noali --domE 1e-5 --cpu 2 --domtblout {input_file}-core1.out databases/core1.hmm {input_file}.faa",
-        f"hmmsearch -Z 1 --noali --domE 1e-5 --cpu 2 --domtblout {input_file}-core2.out databases/core2.hmm {input_file}.faa",
-        f"cat {input_file}-core1.out {input_file}-core2.out > merged_{input_file}-core.out",
+    With index, only its records (e.g. the contigs passing a length filter) are annotated.
+    backend="pyhmmer" runs everything in-process instead (see annotate_inprocess).
+    """
+    dom_z = 1 if staged or fixed_domz else None
+    if backend == "pyhmmer":
+        return annotate_inprocess(input_file, cpu, budget, staged, index, dom_z)
 
-        f"hmmsearch -Z 1 --noali --domE 1e-5 --cpu 2 --domtblout {input_file}-par1.out databases/par1.hmm {input_file}.faa",
-        f"hmmsearch -Z 1 --noali --domE 1e-5 --cpu 2 --domtblout {input_file}-par2.out databases/par2.hmm {input_file}.faa",
-        f"cat {input_file}-par1.out {input_file}-par2.out > merged_{input_file}-par.out",
+    prefix = work_prefix(input_file, work_dir)
+    faa_file = f"{prefix}.faa"
+    predict_genes(input_file, faa_file, cpu, work_dir, budget, index)
+    if os.path.getsize(faa_file) == 0:
+        print(f"[Note] No proteins predicted for {input_file}, skipping the marker searches")
+        return iter(())
 
-        f"hmmsearch -Z 1 --noali --domE 1e-5 --cpu 2 --domtblout {input_file}-rep1.out databases/rep1.hmm {input_file}.faa",
-        f"hmmsearch  -Z 1 --noali --domE 1e-5 --cpu 2 --domtblout {input_file}-rep2.out databases/rep2.hmm {input_file}.faa",
-        f"cat {input_file}-rep1.out {input_file}-rep2.out > merged_{input_file}-rep.out",
+    if not staged:
+        jobs, search_outputs = search_jobs({"core", "par", "rep"}, faa_file, prefix, combine_profiles, dom_z)
+        job, dnaA_file = kofam_job(faa_file, prefix)
+        run_concurrently(jobs + [job], cpu, budget)
+        return iter_hits(search_outputs, dnaA_file)
 
-        f"exec_annotation -o {input_file}-dnaA.tsv -p databases/dnaa.hal -k databases/ko_list --cpu 2 -f detail {input_file}.faa"
-    ]
+    # 第一步：只搜索 core
+    core_jobs, core_outputs = search_jobs({"core"}, faa_file, prefix, combine_profiles, dom_z)
+    run_concurrently(core_jobs, cpu, budget)
+    core_hits = [hit for file_path, family in core_outputs for hit in iter_domtblout_hits(file_path, family)]
+    core_contigs = {hit.contig_id for hit in core_hits}
 
-    # Execute commands
-    for command in commands:
-        execute_command(command)
+    # 第二步：其余搜索只针对含 core 命中的contig的蛋白
+    core_faa = f"{prefix}.core.faa"
+    proteins = filter_proteins(faa_file, core_contigs, core_faa)
+    print(f"[Note] {len(core_contigs)} contigs with a core hit, {proteins} proteins passed to the remaining searches")
+    if not proteins:
+        return iter(core_hits)
 
-    # Filter DNA data
-    dnaA_file = f"{input_file}-dnaA.tsv"
-    dnaA_output = f"filtered_{input_file}-dnaA.tsv"
-    dnaA_lines = read_lines(dnaA_file)
-    filtered_dnaA = filter_lines(dnaA_lines, "dnaa", 3, 100, alt_score_index=4)
-    write_lines(dnaA_output, filtered_dnaA, mode="w")
-
-    # Process merged files
-    merged_files = [
-        (f"merged_{input_file}-core.out", "core", 7),
-        (f"merged_{input_file}-par.out", "par", 7),
-        (f"merged_{input_file}-rep.out", "rep", 7)
-    ]
-    output_file = f"{input_file}-part1.txt"
+    jobs, search_outputs = search_jobs({"par", "rep"}, core_faa, prefix, combine_profiles, dom_z)
+    job, dnaA_file = kofam_job(core_faa, prefix)
+    run_concurrently(jobs + [job], cpu, budget)
+    return itertools.chain(core_hits, iter_hits(search_outputs, dnaA_file))
+
+def iter_hits(search_outputs, dnaA_file):
+    """Chains the hits of every domtblout in search_outputs [(file, family), ...] and the KofamScan file."""
+    for file_path, family in search_outputs:
+        yield from iter_domtblout_hits(file_path, family)
+    yield from iter_kofam_hits(dnaA_file)
+
+# 标记基因搜索后端：subprocess 调用 prodigal/hmmsearch/exec_annotation；pyhmmer 在进程内运行 pyrodigal/pyhmmer
+BACKENDS = ("subprocess", "pyhmmer")
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == "pyhmmer" and (pyrodigal is None or pyhmmer is None):
+        raise ImportError("The pyhmmer backend needs the pyrodigal and pyhmmer packages (pip install pyrodigal pyhmmer)")
+
+# 每个进程只读取一次 HMM 文件
+_hmm_cache = {}
+
+def load_hmms(hmm_file):
+    if hmm_file not in _hmm_cache:
+        with pyhmmer.plan7.HMMFile(hmm_file) as f:
+            _hmm_cache[hmm_file] = list(f)
+    return _hmm_cache[hmm_file]
 
-    if Path(output_file).exists():
-        Path(output_file).unlink()
+def text_name(name):
+    return name.decode() if isinstance(name, bytes) else name
 
-    for file_path, prefix, score_index in merged_files:
-        process_file(file_path, output_file, prefix, score_index)
+def predict_proteins(input_file, cpu, index=None):
+    """
+    pyrodigal gene calling in meta mode (as prodigal -p meta), contigs in parallel threads.
+    Returns a DigitalSequenceBlock of proteins named <contig>_<n>, with prodigal's "*" stops.
+    """
+    finder = pyrodigal.GeneFinder(meta=True)
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    records = part3.iter_fasta_records(input_file) if index is None else part3.iter_indexed_records(input_file, index)
 
-    # Append filtered DNA data to the output file
-    dnaA_filtered_lines = read_lines(dnaA_output)
-    write_lines(output_file, dnaA_filtered_lines)
+    def translate(record):
+        seq_id, sequence = record
+        return [pyhmmer.easel.TextSequence(name=f"{seq_id}_{n}", sequence=gene.translate()).digitize(alphabet)
+                for n, gene in enumerate(finder.find_genes(sequence), start=1)]
+
+    # 按输入顺序取回结果，排队的 contig 不超过 cpu*2 条，避免把整个组装读入内存
+    proteins = []
+    with ThreadPoolExecutor(max_workers=max(1, cpu)) as executor:
+        futures = deque()
+        for record in records:
+            futures.append(executor.submit(translate, record))
+            if len(futures) >= max(1, cpu) * 2:
+                proteins.extend(futures.popleft().result())
+        for future in futures:
+            proteins.extend(future.result())
+    print(f"[Note] pyrodigal predicted {len(proteins)} proteins")
+    return pyhmmer.easel.DigitalSequenceBlock(alphabet, proteins)
+
+def search_block_hits(hmm_files, family, proteins, cpu, threshold=30, dom_z=None):
+    """
+    Hits of one marker family, as iter_domtblout_hits would parse them from
+    hmmsearch_command(..., dom_z) --domtblout: one per reported domain of a reported
+    target, with the full-sequence score rounded like the table (%.1f).
+    """
+    hmms = [hmm for hmm_file in hmm_files for hmm in load_hmms(hmm_file)]
+    options = {"domZ": dom_z} if dom_z is not None else {}
+    for top_hits in pyhmmer.hmmer.hmmsearch(hmms, proteins, cpus=cpu, Z=1, domE=1e-5, **options):
+        for hit in top_hits:
+            score = round(hit.score, 1)
+            if not hit.reported or score < threshold:
+                continue
+            for _ in hit.domains.reported:
+                yield Hit(*parse_protein_id(text_name(hit.name)), family, score)
+
+def read_ko_list(ko_list_file):
+    """KofamScan ko_list: {KO: (threshold, score_type)}."""
+    thresholds = {}
+    with open(ko_list_file, "r") as f:
+        next(f, None)
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) >= 3:
+                thresholds[columns[0]] = (float(columns[1]) if columns[1] != "-" else None, columns[2])
+    return thresholds
+
+def kofam_profiles(hal_file):
+    """HMM files listed in a KofamScan .hal file (paths relative to it)."""
+    with open(hal_file, "r") as f:
+        return [os.path.join(os.path.dirname(hal_file), line.strip()) for line in f if line.strip()]
+
+def kofam_block_hits(proteins, cpu, threshold=100):
+    """
+    dnaA hits as iter_kofam_hits would parse them from KofamScan -f detail: one row per
+    (protein, KO), scored like KofamScan (full-sequence score, or the best domain score for
+    KOs with score_type "domain" in ko_list), kept when the score passes threshold.
+    """
+    ko_list = read_ko_list(database_file("ko_list"))
+    for hmm_file in kofam_profiles(database_file("dnaa.hal")):
+        knum = os.path.splitext(os.path.basename(hmm_file))[0]
+        score_type = ko_list.get(knum, (None, "full"))[1]
+        for top_hits in pyhmmer.hmmer.hmmsearch(load_hmms(hmm_file), proteins, cpus=cpu):
+            for hit in top_hits:
+                score = round(hit.best_domain.score if score_type == "domain" else hit.score, 1)
+                if hit.reported and score >= threshold:
+                    yield Hit(*parse_protein_id(text_name(hit.name)), "dnaa", score)
+
+def family_hmm_files(family):
+    return [database_file(f"{profile}.hmm") for name, profiles in MARKER_PROFILES if name == family for profile in profiles]
+
+def annotate_inprocess(input_file, cpu=2, budget=None, staged=False, index=None, dom_z=None):
+    """
+    In-process backend of annotate(): proteins stay in memory as digital sequences, each HMM
+    file is loaded once per process, and hits are returned without intermediate files.
+    All profiles of a family are searched in one pass (as with combine_profiles).
+    """
+    check_backend("pyhmmer")
+    threads = budget['stage_cpu'] if budget else cpu
+    with reserved_threads(budget, threads):
+        proteins = predict_proteins(input_file, threads, index)
+        hits = list(search_block_hits(family_hmm_files("core"), "core", proteins, threads, dom_z=dom_z))
+        if staged:
+            core_contigs = {hit.contig_id for hit in hits}
+            proteins = pyhmmer.easel.DigitalSequenceBlock(proteins.alphabet, [
+                protein for protein in proteins if parse_protein_id(text_name(protein.name))[0] in core_contigs])
+            print(f"[Note] {len(core_contigs)} contigs with a core hit, {len(proteins)} proteins passed to the remaining searches")
+        if len(proteins):
+            for family in ("par", "rep"):
+                hits.extend(search_block_hits(family_hmm_files(family), family, proteins, threads, dom_z=dom_z))
+            hits.extend(kofam_block_hits(proteins, threads))
+    return iter(hits)
+
+def marker_sets(hits):
+    sets = {}
+    for hit in hits:
+        sets.setdefault(hit.contig_id, set()).add(hit.family)
+    return sets
+
+def compare_backends(input_file, cpu=2):
+    """Runs both backends on input_file and reports contigs whose marker sets differ; returns True if none do."""
+    expected = marker_sets(annotate(input_file, cpu))
+    observed = marker_sets(annotate(input_file, cpu, backend="pyhmmer"))
+    differences = sorted(contig for contig in expected.keys() | observed.keys()
+                         if expected.get(contig) != observed.get(contig))
+    for contig in differences:
+        print(f"{contig}\tsubprocess={','.join(sorted(expected.get(contig, ())))}\t"
+              f"pyhmmer={','.join(sorted(observed.get(contig, ())))}")
+    print(f"[Note] {len(expected.keys() | observed.keys())} contigs with markers, {len(differences)} differ")
+    return not differences
+
+def main(input_file, cpu=2, backend="subprocess"):
+    output_file = f"{input_file}-part1.txt"
+    write_hits(annotate(input_file, cpu, backend=backend), output_file)
 
     print(f"Processing complete. Final output written to {output_file}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <input_file>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    if len(args) not in (1, 2) or not set(options) <= {"--pyhmmer", "--compare-backends"}:
+        print("Usage: python script.py <input_file> [cpu] [--pyhmmer | --compare-backends]")
         sys.exit(1)
 
-    main(sys.argv[1])
+    cpu = int(args[1]) if len(args) == 2 else 2
+    if "--compare-backends" in options:
+        sys.exit(0 if compare_backends(args[0], cpu) else 1)
+    main(args[0], cpu, "pyhmmer" if "--pyhmmer" in options else "subprocess")
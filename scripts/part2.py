@@ -1,76 +1,56 @@
 import sys
 from collections import defaultdict
 
-def clean_file(input_file, output_file):
-    try:
-        with open(input_file, "r") as infile, open(output_file, "w") as outfile:
-            for line in infile:
-                if line.startswith("#") or not line.strip():
-                    # Write comments and empty lines as-is
-                    outfile.write(line)
-                    continue
+from part1 import read_hits
 
-                parts = line.strip().split()
-                if len(parts) < 2:
-                    # Write lines with insufficient columns as-is
-                    outfile.write(line)
-                    continue
-
-                if parts[0].startswith("dnaa"):
-                    # Clean 'dnaa' prefix and combine with second column
-                    cleaned_prefix = parts[0].replace("*", "") + parts[1]
-                    remaining = " ".join(parts[2:])
-                    outfile.write(f"{cleaned_prefix} {remaining}\n")
-                else:
-                    # Write other lines unchanged
-                    outfile.write(line + "\n")
-
-        print(f"Cleaned data written to {output_file}")
-    except FileNotFoundError:
-        print(f"Error: File {input_file} not found.")
-        sys.exit(1)
-
-def parse_file(file_path):
+def aggregate_markers(hits):
     """
-    Parse the file to build a dictionary mapping sequence IDs to prefixes.
+    Build a dictionary mapping sequence IDs to the set of marker families hit on them.
+    Hits are consumed one at a time, so memory grows with contigs, not with hits.
     """
     data = defaultdict(set)
-    try:
-        with open(file_path, "r") as file:
-            for line in file:
-                if line.startswith("#") or not line.strip():
-                    continue
-
-                columns = line.strip().split()
-                if not columns:
-                    continue
-
-                first_column = columns[0]
-                parts = first_column.split("_")
-
-                if len(parts) < 2:
-                    continue
-
-                prefix = parts[0]
-                sequence_id = "_".join(parts[1:-1])
+    for hit in hits:
+        data[hit.contig_id].add(hit.family)
+    return data
 
-                data[sequence_id].add(prefix)
+def select_candidates(data):
+    """
+    Keep sequences carrying 'core' plus either 'dnaa' or both 'rep' and 'par'.
+    Returns {sequence_id: comma-joined sorted prefixes}.
+    """
+    candidates = {}
+    for seq_id, prefixes in data.items():
+        if ('dnaa' in prefixes and 'core' in prefixes) or \
+           ('dnaa' not in prefixes and all(p in prefixes for p in ['rep', 'core', 'par'])):
+            candidates[seq_id] = ','.join(sorted(prefixes))
+    return candidates
+
+def drop_long_chromids(candidates, lengths, max_length):
+    """
+    Drop candidates without dnaA that are longer than max_length: they can be neither
+    a chromosome (no dnaA) nor a chromid (too long). lengths maps sequence ID -> length.
+    """
+    kept = {seq_id: prefixes for seq_id, prefixes in candidates.items()
+            if 'dnaa' in prefixes.split(',') or lengths.get(seq_id, 0) <= max_length}
+    print(f"[Note] Dropped {len(candidates) - len(kept)} candidates without dnaA longer than {max_length} bp")
+    return kept
 
-        print(f"Parsed {len(data)} unique sequence IDs.")
-        return data
-    except FileNotFoundError:
-        print(f"Error: File {file_path} not found.")
-        sys.exit(1)
+def prescreen(hits):
+    """
+    Part1 hit records -> candidate sequences.
+    """
+    data = aggregate_markers(hits)
+    candidates = select_candidates(data)
+    print(f"Parsed {len(data)} unique sequence IDs, {len(candidates)} candidates.")
+    return candidates
 
-def write_merged_data(data, output_file):
+def write_candidates(candidates, output_file):
     """
-    Write merged prefix data to the output file.
+    Write candidate sequences and their prefixes to the output file.
     """
     with open(output_file, "w") as file:
-        for seq_id, prefixes in data.items():
-            if ('dnaa' in prefixes and 'core' in prefixes) or \
-               ('dnaa' not in prefixes and all(p in prefixes for p in ['rep', 'core', 'par'])):
-                file.write(f"{seq_id}\t{','.join(sorted(prefixes))}\n")
+        for seq_id, prefixes in candidates.items():
+            file.write(f"{seq_id}\t{prefixes}\n")
 
     print(f"Merged data written to {output_file}")
 
@@ -78,10 +58,7 @@ def process_files(input_file, output_file):
     """
     Main function to process input file and produce output.
     """
-    cleaned_file = "temp_cleaned_file.txt"
-    clean_file(input_file, cleaned_file)
-    parsed_data = parse_file(cleaned_file)
-    write_merged_data(parsed_data, output_file)
+    write_candidates(prescreen(read_hits(input_file)), output_file)
     print("Processing complete.")
 
 if __name__ == "__main__":
@@ -1,104 +1,280 @@
 import sys
 import os
-from Bio import SeqIO
 from concurrent.futures import ProcessPoolExecutor
 import gzip
+import itertools
+import ast
+import struct
+import numpy as np
 
-# 计算四联体频率
+import part0
+
+# 256种四联体，按 ACGT 字典序排列，向量下标即 c0*64 + c1*16 + c2*4 + c3
+TETRANUCLEOTIDES = [''.join(p) for p in itertools.product('ACGT', repeat=4)]
+
+# 碱基编码表：A/C/G/T -> 0..3，其它字符（含小写、N 等）-> 4，与原实现只统计大写ATGC保持一致
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+    BASE_CODES[_base] = _code
+
+
+def encode_sequence(sequence):
+    """Encodes a sequence into a uint8 array (A=0, C=1, G=2, T=3, other=4)."""
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii', 'replace')
+    return BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+# 计算四联体相对丰度向量
+def calculate_tetranucleotide_vector(sequence):
+    """
+    Returns a 256-length float64 vector of tetranucleotide relative abundance.
+
+    Values are (observed 4-mer frequency) / (product of base frequencies), computed
+    in the same order as the original dict-based implementation so results are
+    numerically identical; 4-mers that never occur are 0.
+    """
+    vector = np.zeros(256, dtype=np.float64)
+    codes = encode_sequence(sequence)
+    if len(codes) < 4:
+        return vector
+
+    base_counts = np.bincount(codes, minlength=5)[:4]
+    total_bases = int(base_counts.sum())
+
+    # 滚动下标：窗口内任一碱基非ATGC则屏蔽
+    valid = codes < 4
+    window_valid = valid[:-3] & valid[1:-2] & valid[2:-1] & valid[3:]
+    low = codes & 3
+    index = (low[:-3] << 6) | (low[1:-2] << 4) | (low[2:-1] << 2) | low[3:]
+    counts = np.bincount(index[window_valid], minlength=256)
+    total_tetranucleotides = int(counts.sum())
+    if total_tetranucleotides == 0:
+        return vector
+
+    # 期望频率（与原实现相同的乘法顺序）
+    base_freqs = base_counts / total_bases
+    present = np.nonzero(counts)[0]
+    expected = base_freqs[present >> 6] * base_freqs[(present >> 4) & 3] * \
+               base_freqs[(present >> 2) & 3] * base_freqs[present & 3]
+    vector[present] = (counts[present] / total_tetranucleotides) / expected
+    return vector
+
+
+def vector_to_frequencies(vector):
+    """Converts a 256-length vector back to the legacy {tetranucleotide: value} dict."""
+    return {TETRANUCLEOTIDES[i]: float(vector[i]) for i in np.nonzero(vector)[0]}
+
+
+# 计算四联体频率（兼容旧接口，返回 dict）
 def calculate_tetranucleotide_frequencies(sequence):
-    base_freqs = {'A': 0, 'T': 0, 'C': 0, 'G': 0}
-    total_tetranucleotides = 0
-    tetranucleotides = {}
-
-    # 只统计ATGC的碱基频率，忽略其它字符
-    for base in sequence:
-        if base in base_freqs:  # 只统计A, T, C, G
-            base_freqs[base] += 1
-    total_bases = sum(base_freqs.values())
-
-    # 计算四联体频率，只处理ATGC中的四联体
-    for i in range(len(sequence) - 3):
-        tetranucleotide = sequence[i:i + 4]
-        if any(base not in base_freqs for base in tetranucleotide):  # 如果四联体包含非ATGC字符，跳过
-            continue
-        if tetranucleotide not in tetranucleotides:
-            tetranucleotides[tetranucleotide] = 0
-        tetranucleotides[tetranucleotide] += 1
-        total_tetranucleotides += 1
-
-    # 计算期望频率并返回结果
-    expected_freqs = {}
-    for pair, count in tetranucleotides.items():
-        expected_freq = (base_freqs[pair[0]] / total_bases) * \
-                        (base_freqs[pair[1]] / total_bases) * \
-                        (base_freqs[pair[2]] / total_bases) * \
-                        (base_freqs[pair[3]] / total_bases)
-        expected_freqs[pair] = expected_freq
-
-    return {pair: (count / total_tetranucleotides) / expected_freqs[pair] for pair, count in tetranucleotides.items()}
+    return vector_to_frequencies(calculate_tetranucleotide_vector(sequence))
+
+# 二进制四联体矩阵格式：64字节文件头 + float32 行主序 N×256 矩阵，序列ID按行序另存于 <out_file>.ids
+TNF_MAGIC = b'CFTNF001'
+TNF_HEADER = struct.Struct('<8sQI')
+TNF_HEADER_SIZE = 64
+TNF_DTYPE = np.float32
+
+
+def tnf_ids_file(tnf_file):
+    return f"{tnf_file}.ids"
+
+
+def write_tnf_header(handle, n_rows):
+    """Writes (or rewrites) the fixed-size header of a binary TNF store."""
+    handle.seek(0)
+    handle.write(TNF_HEADER.pack(TNF_MAGIC, n_rows, 256).ljust(TNF_HEADER_SIZE, b'\0'))
+
+
+def write_tnf_rows(out_f, ids_f, results):
+    """Appends (seq_id, vector) results to an open store; returns the number of rows written."""
+    for seq_id, vector in results:
+        out_f.write(np.asarray(vector, dtype=TNF_DTYPE).tobytes())
+        ids_f.write(f"{seq_id}\n")
+    return len(results)
+
+
+def is_tnf_store(tnf_file):
+    with open(tnf_file, 'rb') as f:
+        return f.read(len(TNF_MAGIC)) == TNF_MAGIC
+
+
+def load_tnf_store(tnf_file):
+    """Memory-maps a binary TNF store, returning (ids, N×256 float32 matrix)."""
+    with open(tnf_file, 'rb') as f:
+        magic, n_rows, dims = TNF_HEADER.unpack(f.read(TNF_HEADER.size))
+    if magic != TNF_MAGIC or dims != 256:
+        raise ValueError(f"{tnf_file} is not a binary TNF store")
+    with open(tnf_ids_file(tnf_file), 'r') as f:
+        ids = f.read().splitlines()
+    if len(ids) != n_rows:
+        raise ValueError(f"{tnf_file}: {n_rows} rows but {len(ids)} IDs")
+    if n_rows == 0:
+        return ids, np.zeros((0, 256), dtype=TNF_DTYPE)
+    matrix = np.memmap(tnf_file, dtype=TNF_DTYPE, mode='r', offset=TNF_HEADER_SIZE, shape=(n_rows, 256))
+    return ids, matrix
+
+
+def convert_legacy_tnf(text_file, tnf_file):
+    """Converts a legacy part3 text file (seq_id\t{dict repr}) into a binary TNF store."""
+    index = {tetranucleotide: i for i, tetranucleotide in enumerate(TETRANUCLEOTIDES)}
+    n_rows = 0
+    with open(text_file, 'r') as in_f, open(tnf_file, 'wb') as out_f, open(tnf_ids_file(tnf_file), 'w') as ids_f:
+        write_tnf_header(out_f, 0)
+        for line in in_f:
+            parts = line.strip().split('\t', 1)
+            if len(parts) < 2:
+                continue
+            try:
+                freqs = ast.literal_eval(parts[1])
+            except (ValueError, SyntaxError) as e:
+                print(f"[ERROR] Failed to parse frequencies for {parts[0]}: {e}")
+                continue
+            vector = np.zeros(256, dtype=np.float64)
+            for tetranucleotide, value in freqs.items():
+                vector[index[tetranucleotide]] = value
+            n_rows += write_tnf_rows(out_f, ids_f, [(parts[0], vector)])
+        write_tnf_header(out_f, n_rows)
+    print(f"[Note] Converted {n_rows} legacy records from {text_file} to {tnf_file}")
+    return tnf_file
 
 # 处理单条记录
 def process_record(record):
-    seq_id, sequence = record.id, str(record.seq)
-    tetranuc_freqs = calculate_tetranucleotide_frequencies(sequence)
-    return seq_id, tetranuc_freqs
+    seq_id, sequence = record
+    tetranuc_vector = calculate_tetranucleotide_vector(sequence)
+    return seq_id, tetranuc_vector
 
 # 处理记录块（避免嵌套池）
 def process_chunk(chunk):
     return [process_record(record) for record in chunk]
 
+# 读取序列ID白名单（part2.txt 第一列）
+def load_allowlist(allowlist_file):
+    allowed_ids = set()
+    with open(allowlist_file, 'r') as f:
+        for line in f:
+            fields = line.split('\t', 1)
+            if fields[0].strip():
+                allowed_ids.add(fields[0].strip())
+    print(f"[Note] Loaded {len(allowed_ids)} allowed sequence IDs from {allowlist_file}")
+    return allowed_ids
+
+# 流式读取FASTA记录，只扫描标题行跳过白名单外的记录
+def iter_fasta_records(input_file, allowed_ids=None):
+    """Yields (seq_id, sequence bytes); sequence lines of records not in allowed_ids are never joined."""
+    open_func = gzip.open if input_file.endswith('.gz') else open
+    with open_func(input_file, 'rb') as handle:
+        seq_id, lines = None, None
+        for line in handle:
+            if line.startswith(b'>'):
+                if lines is not None:
+                    yield seq_id, b''.join(lines).replace(b' ', b'')
+                fields = line[1:].split(None, 1)
+                seq_id = fields[0].decode() if fields else ''
+                lines = [] if allowed_ids is None or seq_id in allowed_ids else None
+            elif lines is not None:
+                lines.append(line.strip())
+        if lines is not None:
+            yield seq_id, b''.join(lines).replace(b' ', b'')
+
+# 按 part0 索引直接定位读取记录，白名单外的记录整段跳过
+def iter_indexed_records(input_file, index, allowed_ids=None):
+    """Yields (seq_id, sequence bytes) for indexed records, seeking straight to allowed ones."""
+    with open(input_file, 'rb') as handle:
+        for record in index:
+            if allowed_ids is not None and record.seq_id not in allowed_ids:
+                continue
+            handle.seek(record.offset)
+            data = handle.read(record.size)
+            header_end = data.find(b'\n')
+            yield record.seq_id, b''.join(data[header_end + 1:].split()) if header_end >= 0 else b''
+
 # 流式分块读取器
-def stream_fasta_chunks(input_file, chunk_size=100):
-    """流式读取FASTA文件，按内存大小分块"""
+def stream_fasta_chunks(input_file, allowed_ids=None, index=None):
+    """流式读取FASTA文件，按内存大小分块；提供 index 时按索引定位读取"""
     chunk = []
     current_size = 0
     max_chunk_size = 1000 * 1024 * 1024  # 100MB/块
-    
-    open_func = gzip.open if input_file.endswith('.gz') else open
-    with open_func(input_file, 'rt') as handle:
-        for record in SeqIO.parse(handle, "fasta"):
-            rec_size = len(record.seq) + len(record.id) + 100  # 预估内存
-            if current_size + rec_size > max_chunk_size and chunk:
-                yield chunk
-                chunk = []
-                current_size = 0
-                
-            chunk.append(record)
-            current_size += rec_size
-    
+
+    records = iter_fasta_records(input_file, allowed_ids) if index is None else \
+        iter_indexed_records(input_file, index, allowed_ids)
+    for seq_id, sequence in records:
+        rec_size = len(sequence) + len(seq_id) + 100  # 预估内存
+        if current_size + rec_size > max_chunk_size and chunk:
+            yield chunk
+            chunk = []
+            current_size = 0
+
+        chunk.append((seq_id, sequence))
+        current_size += rec_size
+
     if chunk:
         yield chunk
 
-# 主函数（完全重写）
-def main(input_file, out_file, cpu):
-    
-    # 立即打开输出文件（流式写入）
-    with open(out_file, 'w') as out_f:
-        # 创建进程池（单层）
-        with ProcessPoolExecutor(max_workers=cpu) as executor:
-            # 流式分块提交任务
-            futures = []
-            for chunk in stream_fasta_chunks(input_file):
-                future = executor.submit(process_chunk, chunk)
-                futures.append(future)
-                
-                # 及时回收完成的任务
-                while len(futures) >= cpu * 2:  # 控制排队任务数
-                    done = [f for f in futures if f.done()]
-                    for f in done:
-                        for seq_id, freqs in f.result():
-                            out_f.write(f"{seq_id}\t{freqs}\n")
-                        futures.remove(f)
+# 流式计算四联体向量，按完成顺序逐批产出 [(seq_id, vector), ...]
+def iter_tnf_batches(input_file, cpu, allowed_ids=None, index=None, mp_context=None):
+    # 创建进程池（单层）
+    with ProcessPoolExecutor(max_workers=cpu, mp_context=mp_context) as executor:
+        # 流式分块提交任务
+        futures = []
+        for chunk in stream_fasta_chunks(input_file, allowed_ids, index):
+            future = executor.submit(process_chunk, chunk)
+            futures.append(future)
             
-            # 处理剩余任务
-            for future in futures:
-                for seq_id, freqs in future.result():
-                    out_f.write(f"{seq_id}\t{freqs}\n")
+            # 及时回收完成的任务
+            while len(futures) >= cpu * 2:  # 控制排队任务数
+                done = [f for f in futures if f.done()]
+                for f in done:
+                    yield f.result()
+                    futures.remove(f)
+        
+        # 处理剩余任务
+        for future in futures:
+            yield future.result()
+
+# 在内存中计算四联体矩阵，返回 (ids, N×256 float32 矩阵)
+def compute_tnf(input_file, cpu, allowed_ids=None, index=None, mp_context=None):
+    ids, rows = [], []
+    for results in iter_tnf_batches(input_file, cpu, allowed_ids, index, mp_context):
+        for seq_id, vector in results:
+            ids.append(seq_id)
+            rows.append(np.asarray(vector, dtype=TNF_DTYPE))
+    matrix = np.vstack(rows) if rows else np.zeros((0, 256), dtype=TNF_DTYPE)
+    return ids, matrix
+
+# 将内存中的四联体矩阵写成二进制存储
+def write_tnf_store(out_file, ids, matrix):
+    with open(out_file, 'wb') as out_f, open(tnf_ids_file(out_file), 'w') as ids_f:
+        write_tnf_header(out_f, 0)
+        n_rows = write_tnf_rows(out_f, ids_f, list(zip(ids, matrix)))
+        write_tnf_header(out_f, n_rows)
+    return out_file
+
+# 主函数（完全重写）
+def main(input_file, out_file, cpu, allowlist_file=None):
+    allowed_ids = load_allowlist(allowlist_file) if allowlist_file else None
+    # 未压缩输入使用（可复用的）part0 索引定位记录
+    index = None if input_file.endswith('.gz') else part0.build_index(input_file)
+
+    # 立即打开输出文件（流式写入二进制矩阵，行数在结束时回填到文件头）
+    n_rows = 0
+    with open(out_file, 'wb') as out_f, open(tnf_ids_file(out_file), 'w') as ids_f:
+        write_tnf_header(out_f, 0)
+        for results in iter_tnf_batches(input_file, cpu, allowed_ids, index):
+            n_rows += write_tnf_rows(out_f, ids_f, results)
+        write_tnf_header(out_f, n_rows)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:  # 修改参数数量
-        print("用法: python part3.py <input_file> <output_file> <cpu>")
+    if len(sys.argv) == 4 and sys.argv[1] == "--convert":
+        convert_legacy_tnf(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    if len(sys.argv) not in (4, 5):  # 修改参数数量
+        print("用法: python part3.py <input_file> <output_file> <cpu> [allowlist_file]")
+        print("      python part3.py --convert <legacy_part3.txt> <output_file>")
         sys.exit(1)
         
     input_file, out_file, cpu = sys.argv[1], sys.argv[2], int(sys.argv[3])
-    main(input_file, out_file, cpu)
+    allowlist_file = sys.argv[4] if len(sys.argv) == 5 else None
+    main(input_file, out_file, cpu, allowlist_file)
@@ -1,111 +1,167 @@
 import sys
 import pandas as pd
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor, as_completed  # 修复导入问题
+from concurrent.futures import ProcessPoolExecutor
 import os
+from collections import namedtuple
+
+def gc_frame(columns):
+    """Build the GC frame from id/length/GC columns (e.g. part0.gc_columns)."""
+    gc_df = pd.DataFrame({'id': columns['id'], 'length': columns['length'], 'GC': columns['GC']})
+    gc_df.dropna(subset=['GC', 'length'], inplace=True)
+    return gc_df
+
+def load_gc_table(gc_file):
+    """Load the GC table: columnar gc.npz written by the pipeline, or a seqkit gc.tsv."""
+    if gc_file.endswith('.npz'):
+        with np.load(gc_file) as columns:
+            return gc_frame(columns)
 
-def load_and_preprocess_data(gc_file, intput_file):
-    """Load and preprocess the input data."""
-    # Load gc.tsv and ensure numeric data
     gc_df = pd.read_csv(gc_file, sep='\t', header=None, names=['id', 'length', 'GC'])
     gc_df['GC'] = pd.to_numeric(gc_df['GC'], errors='coerce')
     gc_df['length'] = pd.to_numeric(gc_df['length'], errors='coerce')
     gc_df.dropna(subset=['GC', 'length'], inplace=True)
+    return gc_df
+
+def candidates_frame(candidates):
+    """Build the prescreen frame from an in-memory {sequence_id: prefixes} dict."""
+    return pd.DataFrame(list(candidates.items()), columns=['sequence_id', 'prefixes'])
+
+def load_and_preprocess_data(gc_file, intput_file):
+    """Load and preprocess the input data."""
+    gc_df = load_gc_table(gc_file)
 
     # Load prescreen.tsv
     output_df = pd.read_csv(intput_file, sep='\t', header=None, names=['sequence_id', 'prefixes'])
+    return preprocess_data(gc_df, output_df)
+
+def preprocess_data(gc_df, output_df):
+    """
+    Merge the GC table with the prescreen frame and sort candidates by GC.
 
+    Returns numpy arrays in GC order (ids, gc_values, lengths) and the rows of the
+    dnaA sequences, listed in prescreen order.
+    """
     # Merge dataframes on sequence_id and id
     merged_df = output_df.merge(gc_df, left_on='sequence_id', right_on='id', how='left')
+    merged_df['order'] = np.arange(len(merged_df))
+    merged_df.sort_values(by='GC', inplace=True, kind='stable')
 
-    # Filter rows with 'dnaa' prefix
-    dnaa_df = merged_df[merged_df['prefixes'].str.contains('dnaa', na=False)]
-    
-    # 添加索引以加速查找
-    merged_df.set_index('sequence_id', inplace=True)
-    merged_df.sort_values(by='GC', inplace=True)
-    gc_values = merged_df['GC'].values
-
-    return dnaa_df, merged_df, gc_values
-
-def find_clusters(dnaa_row, merged_df, gc_values, gc_threshold=1):
-    """Find clusters for a given dnaa row using optimized search."""
-    cluster = [dnaa_row['sequence_id']]
-    dnaa_gc = dnaa_row['GC']
-    dnaa_length = dnaa_row['length']
-    
-    # 使用二分查找快速定位GC范围
-    left_idx = np.searchsorted(gc_values, dnaa_gc - gc_threshold, side='left')
-    right_idx = np.searchsorted(gc_values, dnaa_gc + gc_threshold, side='right')
-    
-    # 获取候选序列
-    candidates = merged_df.iloc[left_idx:right_idx]
-    # 应用长度过滤
-    valid_sequences = candidates[
-        (candidates['length'] < dnaa_length) & 
-        (candidates.index != dnaa_row['sequence_id'])
-    ]
-    
-    cluster.extend(valid_sequences.index.tolist())
-    return cluster
-
-def process_batch(dnaa_batch, merged_df, gc_values):
-    """处理一批dnaa序列的辅助函数"""
-    return [find_clusters(row, merged_df, gc_values) for _, row in dnaa_batch.iterrows()]
-
-def cluster_sequences(gc_file, intput_file, part4_file):
-    """Main logic to cluster sequences with parallel processing."""
-    dnaa_df, merged_df, gc_values = load_and_preprocess_data(gc_file, intput_file)
-    
-    clusters = []
-    num_processes = os.cpu_count() or 4
-    
-    # 如果dnaa序列数量少，直接单进程处理
-    if len(dnaa_df) < 50:
-        for _, row in dnaa_df.iterrows():
-            clusters.append(find_clusters(row, merged_df, gc_values))
-    else:
-        # 并行处理：将dnaa序列分成批次
-        batch_size = max(1, len(dnaa_df) // num_processes)
-        batches = []
-        for i in range(0, len(dnaa_df), batch_size):
-            batches.append(dnaa_df.iloc[i:i+batch_size])
-        
-        with ProcessPoolExecutor(max_workers=cpu) as executor:
-            futures = []
-            for batch in batches:
-                # 每个批次提交一个任务
-                future = executor.submit(
-                    process_batch, 
-                    batch,
-                    merged_df,
-                    gc_values
-                )
-                futures.append(future)
-            
-            # 修复这里：使用直接导入的 as_completed
-            for future in as_completed(futures):
-                clusters.extend(future.result())
-
-    # 写入文件
+    ids = merged_df['sequence_id'].to_numpy(dtype=object)
+    gc_values = merged_df['GC'].to_numpy(dtype=np.float64)
+    lengths = merged_df['length'].to_numpy(dtype=np.float64)
+
+    # Rows with 'dnaa' prefix
+    dnaa_rows = np.flatnonzero(merged_df['prefixes'].str.contains('dnaa', na=False).to_numpy(dtype=bool))
+    dnaa_rows = dnaa_rows[np.argsort(merged_df['order'].to_numpy()[dnaa_rows], kind='stable')]
+
+    return ids, gc_values, lengths, dnaa_rows
+
+def find_cluster_ranges(gc_values, dnaa_rows, gc_threshold=1):
+    """Binary-search the GC window [GC-1, GC+1] of every dnaA row at once; returns (starts, ends)."""
+    dnaa_gc = gc_values[dnaa_rows]
+    starts = np.searchsorted(gc_values, dnaa_gc - gc_threshold, side='left')
+    ends = np.searchsorted(gc_values, dnaa_gc + gc_threshold, side='right')
+    return starts, ends
+
+# 紧凑聚类表示：按 GC 排序的候选序列数组，加上每个染色体一个 [start, end) 区间。
+# 成员由区间与长度过滤惰性展开；lengths 为 None 时不做长度过滤（如旧版 part4.txt 读入的聚类）。
+ClusterRanges = namedtuple('ClusterRanges', ['ids', 'lengths', 'chromosome_rows', 'starts', 'ends'])
+
+def cluster_members(lengths, chromosome_row, start, end):
+    """Rows in the GC window [start, end) shorter than the chromosome, excluding the chromosome itself."""
+    rows = np.arange(start, end)
+    mask = rows != chromosome_row
+    if lengths is not None:
+        mask &= lengths[start:end] < lengths[chromosome_row]
+    return rows[mask]
+
+def build_clusters(ids, gc_values, lengths, dnaa_rows):
+    """Build one cluster per dnaA sequence as a GC-window range; returns ClusterRanges."""
+    starts, ends = find_cluster_ranges(gc_values, dnaa_rows)
+    return ClusterRanges(ids, lengths, dnaa_rows.astype(np.int64), starts.astype(np.int64), ends.astype(np.int64))
+
+def cluster_count(clusters):
+    return len(clusters.chromosome_rows)
+
+def expand_cluster(clusters, cluster_index):
+    """Returns [central_id, other_id, ...] for one cluster."""
+    row = clusters.chromosome_rows[cluster_index]
+    members = cluster_members(clusters.lengths, row, clusters.starts[cluster_index], clusters.ends[cluster_index])
+    return [clusters.ids[row]] + clusters.ids[members].tolist()
+
+def save_cluster_ranges(clusters, part4_file):
+    """以 .npz 保存紧凑聚类（大小与染色体数和候选序列数成正比）"""
+    columns = {'ids': np.asarray(clusters.ids, dtype=str), 'chromosome_rows': clusters.chromosome_rows,
+               'starts': clusters.starts, 'ends': clusters.ends}
+    if clusters.lengths is not None:
+        columns['lengths'] = clusters.lengths
+    with open(part4_file, 'wb') as f:
+        np.savez(f, **columns)
+
+def load_cluster_ranges(part4_file):
+    with np.load(part4_file) as columns:
+        return ClusterRanges(columns['ids'].astype(object),
+                             columns['lengths'] if 'lengths' in columns else None,
+                             columns['chromosome_rows'], columns['starts'], columns['ends'])
+
+def format_cluster(central_id, other_ids):
+    return (f"Central sequence in the cluster: {central_id}\n"
+            f"Other sequences in the cluster: {', '.join(other_ids)}\n"
+            "------\n")
+
+# 工作进程状态：由进程池 initializer 每个进程只设置一次
+_worker_state = {}
+
+def init_worker(clusters):
+    _worker_state['clusters'] = clusters
+
+def format_cluster_batch(start, end):
+    """把下标范围 [start, end) 内的聚类格式化为 part4.txt 文本"""
+    clusters = _worker_state['clusters']
+    return "".join(format_cluster(cluster[0], cluster[1:])
+                   for cluster in (expand_cluster(clusters, i) for i in range(start, end)))
+
+def write_clusters(clusters, part4_file, cpu=1, mp_context=None):
+    """Write clusters as compact ranges (.npz) or in the legacy part4.txt text format."""
+    if part4_file.endswith('.npz'):
+        save_cluster_ranges(clusters, part4_file)
+        print(f"Clustered data written to {part4_file}")
+        return
+
+    count = cluster_count(clusters)
     with open(part4_file, "w") as f:
-        for cluster in clusters:
-            f.write(f"Central sequence in the cluster: {cluster[0]}\n")
-            f.write(f"Other sequences in the cluster: {', '.join(cluster[1:])}\n")
-            f.write("------\n")
+        # 如果dnaa序列数量少，直接单进程处理
+        if count < 50 or cpu <= 1:
+            init_worker(clusters)
+            f.write(format_cluster_batch(0, count))
+        else:
+            # 并行处理：成员展开与格式化按批次分给各进程，结果按原顺序写出
+            batch_size = max(1, count // (cpu * 4))
+            starts = range(0, count, batch_size)
+            ends = [min(start + batch_size, count) for start in starts]
+            with ProcessPoolExecutor(max_workers=cpu, initializer=init_worker, initargs=(clusters,),
+                                     mp_context=mp_context) as executor:
+                for text in executor.map(format_cluster_batch, starts, ends):
+                    f.write(text)
     print(f"Clustered data written to {part4_file}")
 
+def cluster_sequences(gc_file, intput_file, part4_file, cpu):
+    """Main logic to cluster sequences with parallel processing."""
+    clusters = build_clusters(*load_and_preprocess_data(gc_file, intput_file))
+    write_clusters(clusters, part4_file, cpu)
+
 def main(gc_file, intput_file, part4_file, cpu):
-    cluster_sequences(gc_file, intput_file, part4_file)
+    cluster_sequences(gc_file, intput_file, part4_file, cpu)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <cpu>" )
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python script.py <cpu> [part4.npz|part4.txt]" )
         sys.exit(1)
 
-    gc_file = "gc.tsv"
+    gc_file = "gc.npz" if os.path.exists("gc.npz") else "gc.tsv"
     intput_file = "part2.txt"
-    part4_file = "part4.txt"
+    part4_file = sys.argv[2] if len(sys.argv) == 3 else "part4.npz"
     cpu = int(sys.argv[1])
 
     main(gc_file, intput_file, part4_file,cpu)
@@ -1,22 +1,26 @@
+import os
 import sys
 from concurrent.futures import ProcessPoolExecutor, as_completed
-import ast
+import numpy as np
+from part3 import is_tnf_store, load_tnf_store, convert_legacy_tnf
+from part4 import ClusterRanges, cluster_count, cluster_members, find_cluster_ranges, load_cluster_ranges
+
+
+# 工作进程状态：由进程池 initializer 每个进程只设置一次，任务只传递聚类下标范围
+_worker_state = {}
+
+
+def resolve_tnf_store(temp_file):
+    """返回二进制四联体矩阵路径（旧文本格式先转换）"""
+    if not is_tnf_store(temp_file):
+        print(f"[Note] {temp_file} is in the legacy text format, converting")
+        temp_file = convert_legacy_tnf(temp_file, f"{temp_file}.tnf")
+    return temp_file
 
 
 def read_tetranucleotide_frequencies(temp_file):
-    """从 temp_file 加载四核苷酸频率数据"""
-    tetranucleotide_frequencies = {}
-    with open(temp_file, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line:
-                parts = line.split('\t', 1)
-                if len(parts) > 1:
-                    try:
-                        tetranucleotide_frequencies[parts[0]] = ast.literal_eval(parts[1])
-                    except (ValueError, SyntaxError) as e:
-                        print(f"[ERROR] Failed to parse frequencies for {parts[0]}: {e}")
-    return tetranucleotide_frequencies
+    """从 temp_file 加载四核苷酸频率数据（二进制矩阵直接内存映射）"""
+    return load_tnf_store(resolve_tnf_store(temp_file))
 
 
 def load_prescreen_data(prescreen_file):
@@ -37,89 +41,363 @@ def load_prescreen_data(prescreen_file):
     return prescreen_prefixes, dnaa_sequences
 
 
-def calculate_relative_abundance_distance(freq1, freq2):
-    """计算两个四核苷酸频率之间的距离"""
-    return sum((freq1.get(tetranucleotide, 0) - freq2.get(tetranucleotide, 0)) ** 2 for tetranucleotide in freq1)
+# 距离度量：legacy 只统计染色体中出现的四联体（与旧版评分一致），euclidean 统计全部256维
+DISTANCE_METRICS = ('legacy', 'euclidean')
 
 
-def process_single_cluster(cluster, sequences, precomputed_frequencies, prescreen_prefixes, distance_threshold):
-    """处理单个聚类"""
-    dnaa_seq_id = cluster['dnaa'][0]
-    if len(cluster['dnaa']) != 1 or dnaa_seq_id not in sequences:
+def calculate_relative_abundance_distance(freq1, freq2):
+    """计算两个四核苷酸频率之间的距离（旧版逐对评分，仅统计 freq1 中出现的四联体）"""
+    mask = freq1 > 0
+    diff = freq1[mask].astype(np.float64) - freq2[mask]
+    return float(np.dot(diff, diff))
+
+
+def calculate_cluster_distances(matrix, chromosome_row, member_rows, metric='legacy'):
+    """一次性计算聚类中所有成员到染色体的距离：取出成员行、减去染色体行、按行求平方和"""
+    chromosome_vector = np.asarray(matrix[chromosome_row], dtype=np.float64)
+    if metric == 'legacy':
+        columns = np.flatnonzero(chromosome_vector)
+    elif metric == 'euclidean':
+        columns = np.arange(chromosome_vector.shape[0])
+    else:
+        raise ValueError(f"Unknown distance metric: {metric}")
+
+    diff = matrix[np.ix_(member_rows, columns)].astype(np.float64) - chromosome_vector[columns]
+    return np.einsum('ij,ij->i', diff, diff)
+
+
+# 枢轴（pivot）半径索引：仅用于 euclidean 度量。预先计算每条序列到 k 个枢轴的欧氏距离，
+# 由三角不等式 d(q, x) >= max_p |d(q, p) - d(x, p)| 得到距离下界，下界超过半径 sqrt(dt)
+# 的成员无需计算 256 维距离。剩余成员仍按原方式精确计算，因此结果与暴力计算完全相同。
+# legacy 距离只比较染色体中出现的四联体，不满足三角不等式，不能使用该索引。
+PIVOT_COUNT = 16
+
+
+def select_pivots(matrix, num_pivots=PIVOT_COUNT, seed=0):
+    """最远点遍历选取枢轴：从随机一行开始，每次选取到已选枢轴最小距离最大的一行"""
+    if not len(matrix):
+        return np.zeros(0, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    pivots = [int(rng.integers(len(matrix)))]
+    nearest = np.full(len(matrix), np.inf)
+    for _ in range(min(num_pivots, len(matrix)) - 1):
+        nearest = np.minimum(nearest, pivot_distances(matrix, pivots[-1:])[:, 0])
+        pivots.append(int(np.argmax(nearest)))
+    return np.array(pivots, dtype=np.int64)
+
+
+def pivot_distances(matrix, pivots, block_rows=65536):
+    """每行到各枢轴的欧氏距离（N × k，float64），按块计算以限制内存"""
+    pivot_vectors = np.asarray(matrix[pivots], dtype=np.float64)
+    distances = np.empty((len(matrix), len(pivot_vectors)), dtype=np.float64)
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float64)
+        for column, pivot in enumerate(pivot_vectors):
+            diff = block - pivot
+            distances[start:start + len(block), column] = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    return distances
+
+
+def build_pivot_index(matrix, num_pivots=PIVOT_COUNT):
+    return pivot_distances(matrix, select_pivots(matrix, num_pivots))
+
+
+def radius_prefilter(pivot_index, chromosome_row, member_rows, distance_threshold):
+    """返回下界不超过半径的成员掩码；半径略微放宽，避免浮点误差误删边界上的成员"""
+    radius = np.sqrt(distance_threshold) * (1 + 1e-9) + 1e-12
+    lower_bounds = np.abs(pivot_index[member_rows] - pivot_index[chromosome_row]).max(axis=1)
+    return lower_bounds <= radius
+
+
+def sweep_single_cluster(clusters, cluster_index, tnf_rows, excluded, matrix, thresholds, metric='legacy',
+                         pivot_index=None):
+    """
+    处理单个聚类：按区间惰性展开成员，去掉无四联体向量或本身含 dnaA 的序列后计算一次距离，
+    再与每个阈值（升序）比较。返回与 thresholds 等长的列表（未通过的阈值为 None），无可评分成员时返回 None。
+    """
+    chromosome_row = clusters.chromosome_rows[cluster_index]
+    if tnf_rows[chromosome_row] < 0:
         return None
 
-    dnaa_freq = precomputed_frequencies.get(dnaa_seq_id, {})
-    filtered_sequences = [dnaa_seq_id]
-
-    for seq_id in cluster['sequences']:
-        if seq_id not in sequences or 'dnaa' in prescreen_prefixes.get(seq_id, ''):
-            continue
-
-        seq_freq = precomputed_frequencies.get(seq_id, {})
-        distance = calculate_relative_abundance_distance(dnaa_freq, seq_freq)
-
-        if distance <= distance_threshold:
-            filtered_sequences.append(seq_id)
-
-    if len(filtered_sequences) > 1:
-        return filtered_sequences
-
-
+    members = cluster_members(clusters.lengths, chromosome_row,
+                              clusters.starts[cluster_index], clusters.ends[cluster_index])
+    members = members[(tnf_rows[members] >= 0) & ~excluded[members]]
+    if pivot_index is not None:
+        # 按最大阈值的半径预筛，较小阈值的结果是其子集
+        members = members[radius_prefilter(pivot_index, tnf_rows[chromosome_row], tnf_rows[members], thresholds[-1])]
+    if not len(members):
+        return None
 
-def process_clusters_in_chunks(cluster_chunk, sequences_list, tetranucleotide_frequencies, prescreen_prefixes, distance_threshold):
-    """处理聚类的多个块"""
-    return [cluster for cluster in (process_single_cluster(cluster, sequences_list, tetranucleotide_frequencies, prescreen_prefixes, distance_threshold) for cluster in cluster_chunk) if cluster]
+    distances = calculate_cluster_distances(matrix, tnf_rows[chromosome_row], tnf_rows[members], metric)
+    results = []
+    for distance_threshold in thresholds:
+        passed = distances <= distance_threshold
+        results.append([clusters.ids[chromosome_row]] + clusters.ids[members[passed]].tolist() if passed.any() else None)
+    return results
+
+
+def init_worker(tnf, clusters, dnaa_sequences, thresholds, metric, gc_values=None, pivot_index=None):
+    """
+    进程池 initializer：每个工作进程内存映射一次四联体矩阵（或接收内存中的 (ids, matrix)），
+    并把聚类中的候选序列一次性映射到矩阵行号（无向量为 -1）与 dnaA 排除掩码。
+    融合模式下 clusters 的区间留空，另传入按 GC 排序的 gc_values 供工作进程自行查找窗口；
+    pivot_index 为主进程建立的枢轴距离表（euclidean 索引模式）；thresholds 为升序的距离阈值。
+    """
+    ids, matrix = load_tnf_store(tnf) if isinstance(tnf, str) else tnf
+    sequence_index = {seq_id: row for row, seq_id in enumerate(ids)}
+    _worker_state.update(
+        tnf_rows=np.fromiter((sequence_index.get(seq_id, -1) for seq_id in clusters.ids),
+                             dtype=np.int64, count=len(clusters.ids)),
+        excluded=np.fromiter((seq_id in dnaa_sequences for seq_id in clusters.ids),
+                             dtype=bool, count=len(clusters.ids)),
+        matrix=matrix,
+        clusters=clusters,
+        thresholds=thresholds,
+        metric=metric,
+        gc_values=gc_values,
+        pivot_index=pivot_index,
+    )
+
+
+def process_clusters_in_chunks(start, end):
+    """处理下标范围 [start, end) 内的聚类，返回 (已评估数量, [(聚类下标, 各阈值的结果)])"""
+    state = _worker_state
+    results = []
+    for cluster_index in range(start, end):
+        clusters = sweep_single_cluster(state['clusters'], cluster_index, state['tnf_rows'], state['excluded'],
+                                        state['matrix'], state['thresholds'], state['metric'], state['pivot_index'])
+        if clusters and any(clusters):
+            results.append((cluster_index, clusters))
+    return end - start, results
+
+
+def score_chromosomes(start, end):
+    """
+    融合模式：对第 [start, end) 个染色体就地二分查找 GC 窗口，按长度与 dnaA 过滤后立即计算距离，
+    只返回通过阈值的序列；聚类成员列表与区间都不在主进程中生成。
+    """
+    state = _worker_state
+    chromosome_rows = state['clusters'].chromosome_rows[start:end]
+    starts, ends = find_cluster_ranges(state['gc_values'], chromosome_rows)
+    window = state['clusters']._replace(chromosome_rows=chromosome_rows, starts=starts, ends=ends)
+
+    results = []
+    for offset in range(end - start):
+        clusters = sweep_single_cluster(window, offset, state['tnf_rows'], state['excluded'],
+                                        state['matrix'], state['thresholds'], state['metric'], state['pivot_index'])
+        if clusters and any(clusters):
+            results.append((start + offset, clusters))
+    return end - start, results
 
 
 def read_clusters(clustered_output_file):
-    """读取聚类数据"""
-    clusters, current_cluster = [], None
+    """读取旧版文本格式的聚类数据，返回 ClusterRanges"""
+    cluster_lists = []
 
     with open(clustered_output_file, 'r') as file:
         for line in file:
             line = line.strip()
             if line.startswith("Central sequence in the cluster:"):
-                if current_cluster:
-                    clusters.append(current_cluster)
-                current_cluster = {'dnaa': [line.split(":")[1].strip()], 'sequences': []}
+                cluster_lists.append([line.split(":")[1].strip()])
             elif line.startswith("Other sequences in the cluster:"):
-                if current_cluster:
+                if cluster_lists:
                     sequences = line.split(":")[1].strip()
                     if sequences:
-                        current_cluster['sequences'] = sequences.split(", ")
-            elif line == "------":
-                continue
-
-        if current_cluster:
-            clusters.append(current_cluster)
-
-    print(f"[Note] Loaded {len(clusters)} clusters.")
-    return clusters
-
-
-def filter_sequences(clustered_output_file, prescreen_file, temp_file, final_output_file, cpu, distance_threshold):
-    """主过滤函数，处理整个流程"""
-
-    tetranucleotide_frequencies = read_tetranucleotide_frequencies(temp_file)
-    prescreen_prefixes, _ = load_prescreen_data(prescreen_file)
-    clusters = read_clusters(clustered_output_file)
-
-    sequences_list = list(tetranucleotide_frequencies.keys())
-    chunk_size = max(1, len(clusters) // cpu)
-    cluster_chunks = list(grouper(clusters, chunk_size))
-
-    with ProcessPoolExecutor(max_workers=cpu) as executor:
-        futures = [executor.submit(process_clusters_in_chunks, chunk, sequences_list, tetranucleotide_frequencies, prescreen_prefixes, distance_threshold) for chunk in cluster_chunks]
-
-        filtered_clusters = []
+                        cluster_lists[-1].extend(sequences.split(", "))
+
+    print(f"[Note] Loaded {len(cluster_lists)} clusters.")
+    return clusters_from_lists(cluster_lists)
+
+
+def load_clusters(clustered_output_file):
+    """读取聚类：part4.npz 紧凑区间或旧版 part4.txt"""
+    if clustered_output_file.endswith('.npz'):
+        clusters = load_cluster_ranges(clustered_output_file)
+        print(f"[Note] Loaded {cluster_count(clusters)} clusters.")
+        return clusters
+    return read_clusters(clustered_output_file)
+
+
+def clusters_from_lists(cluster_lists):
+    """把 [[中心序列, 其它序列...], ...] 依次排成区间：中心序列之后紧跟其成员，不做长度过滤"""
+    ids, chromosome_rows, starts, ends = [], [], [], []
+    for cluster in cluster_lists:
+        chromosome_rows.append(len(ids))
+        starts.append(len(ids) + 1)
+        ids.extend(cluster)
+        ends.append(len(ids))
+    return ClusterRanges(np.array(ids, dtype=object), None, np.array(chromosome_rows, dtype=np.int64),
+                         np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64))
+
+
+def filter_sequences(clustered_output_file, prescreen_file, temp_file, final_output_file, cpu, distance_threshold, metric='legacy',
+                     use_index=False):
+    """主过滤函数，处理整个流程；distance_threshold 为多个阈值时写出每个阈值的结果与汇总表"""
+
+    tnf_file = resolve_tnf_store(temp_file)
+    _, dnaa_sequences = load_prescreen_data(prescreen_file)
+    clusters = load_clusters(clustered_output_file)
+
+    thresholds = as_thresholds(distance_threshold)
+    results = sweep_clusters(clusters, tnf_file, dnaa_sequences, cpu, thresholds, metric, use_index)
+    write_results(results, final_output_file)
+
+
+# 阈值扫描：-d 可以是单个值、逗号分隔的列表或 start:stop:step 范围（包含 stop），
+# 每个染色体与候选序列的距离只计算一次，再与所有阈值比较
+def parse_thresholds(text):
+    """'1.6' / '1,1.6,2' / '1:2:0.25' -> 升序去重的阈值元组"""
+    thresholds = []
+    for part in text.split(','):
+        fields = part.split(':')
+        if len(fields) == 1:
+            thresholds.append(float(fields[0]))
+        elif len(fields) == 3:
+            start, stop, step = (float(field) for field in fields)
+            if step <= 0 or stop < start:
+                raise ValueError(f"Invalid threshold range: {part}")
+            count = int(np.floor((stop - start) / step + 1e-9)) + 1
+            thresholds.extend(round(start + i * step, 10) for i in range(count))
+        else:
+            raise ValueError(f"Invalid threshold: {part}")
+    return as_thresholds(thresholds)
+
+
+def as_thresholds(distance_threshold):
+    """单个阈值或阈值序列 -> 升序去重的元组"""
+    if np.ndim(distance_threshold) == 0:
+        return (float(distance_threshold),)
+    thresholds = tuple(sorted({float(value) for value in distance_threshold}))
+    if not thresholds:
+        raise ValueError("No distance thresholds given")
+    return thresholds
+
+
+def format_threshold(distance_threshold):
+    """阈值的最短精确写法（repr，去掉末尾的 .0）：不同的阈值不会得到相同的文件名或汇总行"""
+    text = repr(float(distance_threshold))
+    return text[:-2] if text.endswith('.0') else text
+
+
+def sweep_output_file(final_output_file, distance_threshold):
+    """扫描模式下每个阈值的输出文件：out.txt -> out.d1.6.txt"""
+    root, ext = os.path.splitext(final_output_file)
+    return f"{root}.d{format_threshold(distance_threshold)}{ext}"
+
+
+def write_results(results, final_output_file):
+    """
+    写出 {阈值: 聚类列表}：只有一个阈值时直接写 final_output_file；多个阈值时每个阈值写一个
+    sweep_output_file()，并写出 <root>.sweep.tsv 汇总每个阈值的染色体与 chromid 数量
+    """
+    if len(results) == 1:
+        write_filtered_clusters(next(iter(results.values())), final_output_file)
+        return
+
+    summary_file = f"{os.path.splitext(final_output_file)[0]}.sweep.tsv"
+    with open(summary_file, 'w') as summary:
+        summary.write("dt\tchromosomes\tchromids\toutput\n")
+        for distance_threshold, filtered_clusters in results.items():
+            output_file = sweep_output_file(final_output_file, distance_threshold)
+            write_filtered_clusters(filtered_clusters, output_file)
+            chromids = sum(len(cluster) - 1 for cluster in filtered_clusters)
+            summary.write(f"{format_threshold(distance_threshold)}\t{len(filtered_clusters)}\t{chromids}\t{output_file}\n")
+    print(f"[Note] Threshold sweep summary written to {summary_file}")
+
+
+def prepare_pivot_index(tnf, metric, use_index):
+    """use_index 时为四联体矩阵建立枢轴索引（只支持 euclidean 度量）"""
+    if not use_index:
+        return None
+    if metric != 'euclidean':
+        raise ValueError("The TNF radius index requires the euclidean metric")
+    _, matrix = load_tnf_store(tnf) if isinstance(tnf, str) else tnf
+    pivot_index = build_pivot_index(matrix)
+    print(f"[Note] Built TNF pivot index ({pivot_index.shape[1]} pivots, {len(matrix)} sequences)")
+    return pivot_index
+
+
+def collect_sweep(indexed_clusters, thresholds):
+    """[(聚类下标, 各阈值的结果)] -> {阈值: 按聚类下标排序的结果列表}"""
+    indexed_clusters.sort(key=lambda item: item[0])
+    results = {}
+    for position, distance_threshold in enumerate(thresholds):
+        results[distance_threshold] = [clusters[position] for _, clusters in indexed_clusters if clusters[position]]
+        print(f"[Note] Finally clustered {len(results[distance_threshold])} clusters"
+              f"{f' at dt={format_threshold(distance_threshold)}' if len(thresholds) > 1 else ''}.")
+    return results
+
+
+def sweep_clusters(clusters, tnf, dnaa_sequences, cpu, thresholds, metric='legacy', use_index=False, mp_context=None):
+    """
+    对所有聚类（ClusterRanges）按一组阈值评分（每个距离只计算一次），返回 {阈值: 聚类列表}；
+    tnf 可以是二进制矩阵路径或内存中的 (ids, matrix)，mp_context 为进程池的 multiprocessing 上下文
+    """
+    thresholds = as_thresholds(thresholds)
+    cluster_chunks = schedule_cluster_chunks(clusters, cpu)
+    pivot_index = prepare_pivot_index(tnf, metric, use_index)
+
+    with ProcessPoolExecutor(max_workers=cpu, initializer=init_worker,
+                             initargs=(tnf, clusters, dnaa_sequences, thresholds, metric,
+                                       None, pivot_index), mp_context=mp_context) as executor:
+        # 块按权重从大到小提交，空闲进程从队列动态领取下一块
+        futures = [executor.submit(process_clusters_in_chunks, start, end) for start, end in cluster_chunks]
+
+        evaluated = 0
+        indexed_clusters = []
         for future in as_completed(futures):
             try:
-                filtered_clusters.extend(future.result())
+                count, results = future.result()
+                evaluated += count
+                indexed_clusters.extend(results)
             except Exception as e:
                 print(f"Error processing cluster chunk: {e}")
 
-    print(f"[Note] Finally clustered {len(filtered_clusters)} clusters.")
+    if evaluated != cluster_count(clusters):
+        raise RuntimeError(f"Only {evaluated} of {cluster_count(clusters)} clusters were evaluated")
+
+    print(f"[Note] Evaluated {evaluated} clusters in {len(cluster_chunks)} chunks.")
+    return collect_sweep(indexed_clusters, thresholds)
+
+
+def cluster_and_sweep(ids, gc_values, lengths, dnaa_rows, tnf, dnaa_sequences, cpu, thresholds, metric='legacy',
+                      use_index=False, chunks_per_worker=8, mp_context=None):
+    """
+    part4 与 part5 融合的单趟阶段：输入为 part4.preprocess_data 的 GC 排序数组，
+    每个工作进程对分到的染色体查找 GC 窗口并立即按一组阈值评分；返回 {阈值: 聚类列表}，
+    结果与 build_clusters + sweep_clusters 相同。
+    """
+    thresholds = as_thresholds(thresholds)
+    count = len(dnaa_rows)
+    clusters = ClusterRanges(ids, lengths, np.asarray(dnaa_rows, dtype=np.int64), None, None)
+    chunk_size = max(1, -(-count // (max(1, cpu) * chunks_per_worker)))
+    chunks = [(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+    pivot_index = prepare_pivot_index(tnf, metric, use_index)
+
+    with ProcessPoolExecutor(max_workers=cpu, initializer=init_worker,
+                             initargs=(tnf, clusters, dnaa_sequences, thresholds, metric,
+                                       gc_values, pivot_index), mp_context=mp_context) as executor:
+        futures = [executor.submit(score_chromosomes, start, end) for start, end in chunks]
+
+        evaluated = 0
+        indexed_clusters = []
+        for future in as_completed(futures):
+            try:
+                chunk_count, results = future.result()
+                evaluated += chunk_count
+                indexed_clusters.extend(results)
+            except Exception as e:
+                print(f"Error processing chromosome chunk: {e}")
+
+    if evaluated != count:
+        raise RuntimeError(f"Only {evaluated} of {count} chromosomes were evaluated")
+
+    print(f"[Note] Evaluated {evaluated} chromosomes in {len(chunks)} chunks (fused clustering and scoring).")
+    return collect_sweep(indexed_clusters, thresholds)
 
+
+def write_filtered_clusters(filtered_clusters, final_output_file):
+    """写出最终结果"""
     with open(final_output_file, "w") as outfile:
         for cluster in filtered_clusters:
             outfile.write("Possible bacterial chromosome:\n")
@@ -129,23 +407,48 @@ def filter_sequences(clustered_output_file, prescreen_file, temp_file, final_out
             outfile.write("------\n")
 
 
-def grouper(iterable, n):
-    """将列表分割成固定大小的块"""
-    args = [iter(iterable)] * n
-    return zip(*args)
+def schedule_cluster_chunks(clusters, cpu, chunks_per_worker=8):
+    """
+    按成员数加权把聚类切分为连续下标范围 [start, end)，覆盖全部聚类（不丢弃尾部）。
+
+    每块目标权重约为总权重的 1/(cpu*chunks_per_worker)，超大的聚类单独成块；
+    返回的块按权重从大到小排列，配合进程池队列实现动态调度。
+    """
+    # 权重取 GC 窗口大小（长度过滤前的成员数上界）
+    weights = (1 + clusters.ends - clusters.starts).tolist()
+    target = max(1, sum(weights) / (max(1, cpu) * chunks_per_worker))
+
+    chunks, start, chunk_weight = [], 0, 0
+    for index, weight in enumerate(weights):
+        if chunk_weight and chunk_weight + weight > target:
+            chunks.append((chunk_weight, start, index))
+            start, chunk_weight = index, 0
+        chunk_weight += weight
+    if start < len(weights):
+        chunks.append((chunk_weight, start, len(weights)))
+
+    chunks.sort(key=lambda chunk: chunk[0], reverse=True)
+    return [(start, end) for _, start, end in chunks]
 
 
 # 主函数入口
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python script.py <final_output_file> <cpu> <dt>")
+    use_index = "--index" in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != "--index"]
+    if len(args) not in (3, 4) or (len(args) == 4 and args[3] not in DISTANCE_METRICS) \
+            or (use_index and args[3:] != ['euclidean']):
+        print("Usage: python script.py <final_output_file> <cpu> <dt> [legacy|euclidean] [--index]")
+        print("       --index (euclidean only): prune candidates with an exact pivot radius index")
+        print("       <dt> may be a list (1,1.6,2) or a range (1:2:0.2): one output per value plus <output>.sweep.tsv")
         sys.exit(1)
 
-    clustered_output_file = "part4.txt"
+    clustered_output_file = "part4.npz" if os.path.exists("part4.npz") else "part4.txt"
     prescreen_file = "part2.txt"
-    temp_file = "part3.txt"
-    final_output_file = sys.argv[1]
-    cpu = int(sys.argv[2])
-    distance_threshold = float(sys.argv[3])
+    temp_file = "part3.tnf"
+    final_output_file = args[0]
+    cpu = int(args[1])
+    distance_threshold = parse_thresholds(args[2])
+    metric = args[3] if len(args) == 4 else 'legacy'
     
-    filter_sequences(clustered_output_file, prescreen_file, temp_file, final_output_file, cpu , distance_threshold)
+    filter_sequences(clustered_output_file, prescreen_file, temp_file, final_output_file, cpu , distance_threshold, metric,
+                     use_index)
@@ -0,0 +1,290 @@
+"""
+In-process Chromid-Finder pipeline.
+
+Each stage is a function that takes and returns in-memory structures:
+
+    index      = part0.build_index(input_file)                  # offsets, lengths, GC counts
+    gc_table   = generate_gc_table(index)                       # id / length / GC columns
+    hits       = find_markers(input_file, cpu)                  # part1: iterator of Hit records
+    candidates = prescreen(hits)                                # part2: {seq_id: prefixes}
+    tnf        = compute_tnf(input_file, cpu, candidates)       # part3: (ids, N×256 matrix)
+    clusters   = build_clusters(gc_table, candidates)           # part4: GC-window ranges (ClusterRanges)
+    results    = sweep_clusters(clusters, tnf, candidates, ...) # part5: {dt: filtered clusters}
+
+With fused=True, part4 and part5 are replaced by cluster_and_sweep(), which finds
+each chromosome's GC window and scores it in the same worker, so the clusters
+are never materialized (and no part4 checkpoint is written).
+
+Intermediate files (gc.npz, part1.txt, part2.txt, part3.tnf, part4.npz) are only written
+when a checkpoint directory is given. Scratch files of the external tools (proteins,
+search tables, prodigal shards) go to a per-run work directory, which is removed
+at the end of the run; nothing else is deleted, so several runs can share a node.
+
+run_batch() runs the samples of a manifest in one process under a single CPU budget.
+
+With a cache directory, the marker hits, TNF matrix and clusters are cached under
+keys derived from the input file, database and parameter hashes (see stage_cache),
+so a rerun with another -d or metric only recomputes part5. Several -d values can
+also be scored in one part5 pass (a threshold sweep, see part5.write_results).
+
+With a contig cache (see annotation_cache), marker hits and TNF vectors are also
+cached per contig under a hash of its sequence, so a new assembly that shares
+contigs with earlier ones only runs gene prediction and the searches on new contigs.
+"""
+import os
+import time
+import multiprocessing
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import part0
+import part1
+import part2
+import part3
+import part4
+import part5
+import stage_cache
+import annotation_cache
+
+
+# 由 FASTA 索引生成 id/length/GC 表（与 seqkit fx2tab -l -g 的数值一致）
+def generate_gc_table(index):
+    return part0.gc_columns(index)
+
+# part1：基因预测（按输入大小与核数自动拆分 prodigal）与标记基因搜索，返回命中记录迭代器
+def find_markers(input_file, cpu, combine_profiles=False, work_dir=None, budget=None, staged=False, index=None,
+                 backend="subprocess", fixed_domz=False):
+    return part1.annotate(input_file, cpu, combine_profiles, work_dir, budget, staged, index, backend, fixed_domz)
+
+# part2：边读取命中记录边汇总每条序列的标记基因，筛选候选序列
+def prescreen(hits):
+    return part2.prescreen(hits)
+
+# part3：按索引只读取候选序列并计算四联体矩阵
+def compute_tnf(input_file, cpu, candidates, index=None, mp_context=None):
+    return part3.compute_tnf(input_file, cpu, set(candidates), index, mp_context)
+
+# part4 的输入：按 GC 排序的候选序列数组 (ids, gc_values, lengths, dnaa_rows)
+def sorted_candidates(gc_table, candidates):
+    return part4.preprocess_data(part4.gc_frame(gc_table), part4.candidates_frame(candidates))
+
+def dnaa_sequences(candidates):
+    return {seq_id for seq_id, prefixes in candidates.items() if 'dnaa' in prefixes}
+
+# part4：按 GC 与长度构建聚类（每个染色体一个 GC 窗口区间，成员在 part5 中惰性展开）
+def build_clusters(gc_table, candidates):
+    return part4.build_clusters(*sorted_candidates(gc_table, candidates))
+
+# part5：按四联体距离过滤聚类；thresholds 为一个或多个 -d 值，每个距离只计算一次，返回 {阈值: 聚类列表}
+def sweep_clusters(clusters, tnf, candidates, cpu, thresholds, metric="legacy", use_index=False, mp_context=None):
+    return part5.sweep_clusters(clusters, tnf, dnaa_sequences(candidates), cpu, thresholds, metric, use_index,
+                                mp_context=mp_context)
+
+# part4 + part5 融合：每个染色体查找 GC 窗口后立即按四联体距离评分
+def cluster_and_sweep(gc_table, candidates, tnf, cpu, thresholds, metric="legacy", use_index=False, mp_context=None):
+    return part5.cluster_and_sweep(*sorted_candidates(gc_table, candidates), tnf, dnaa_sequences(candidates), cpu,
+                                   thresholds, metric, use_index, mp_context=mp_context)
+
+# 可选的阶段缓存：命中时读取缓存条目，未命中时计算并写入缓存。
+# stream=True 时 compute() 返回迭代器：边计算边写入缓存条目，再从写好的条目中读回，不在内存中保留整个结果
+def cached_stage(cache, stage, compute, save, load, stream=False):
+    if cache is None:
+        return compute()
+    cache_dir, cache_size, keys = cache
+    entry = stage_cache.lookup(cache_dir, stage, keys[stage])
+    if entry:
+        return load(entry)
+    result = compute()
+    entry = stage_cache.store(cache_dir, stage, keys[stage], lambda path: save(result, path), cache_size)
+    return load(entry) if stream else result
+
+# 写出可选的中间检查点
+def write_checkpoint(checkpoint_dir, name, writer, *args):
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        writer(*args, os.path.join(checkpoint_dir, name))
+
+# 每次运行独立的临时工作目录（可放在本地 NVMe 或 tmpfs 上）
+def make_work_dir(scratch_dir=None):
+    if scratch_dir:
+        os.makedirs(scratch_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="chromid-finder-", dir=scratch_dir)
+    print(f"[Note] Working directory: {work_dir}")
+    return work_dir
+
+def run_pipeline(input_file, cpu, output_file, dt, *, metric="legacy", use_index=False, fused=False,
+                 checkpoint_dir=None, scratch_dir=None, keep_work_dir=False, budget=None,
+                 combine_profiles=False, staged_search=False, backend="subprocess",
+                 min_length=0, max_chromid_length=None,
+                 cache_dir=None, cache_size=None, contig_cache=None, contig_cache_size=None):
+    """
+    Runs every stage in-process and returns {dt: filtered clusters}. dt is one threshold or
+    a sequence of them (one output per threshold, see part5.write_results). Options are
+    keyword-only:
+
+    metric, use_index        part5 TNF distance (part5.DISTANCE_METRICS), euclidean pivot index
+    fused                    find and score each chromosome's GC window in one pass
+    checkpoint_dir           where intermediates are written (not written without it)
+    scratch_dir              parent of the run's work directory for external tool files
+                             (default: the system temporary directory)
+    keep_work_dir            keep the work directory instead of removing it
+    budget                   part1.make_budget() CPU budget shared with other samples (batch mode)
+    combine_profiles         one hmmsearch pass per marker family
+    staged_search            par/rep/dnaA searches only on contigs with a core hit
+    backend                  part1 gene prediction and search backend (part1.BACKENDS)
+    min_length               contigs shorter than this never reach gene prediction
+    max_chromid_length       drop candidates without dnaA longer than this
+    cache_dir, cache_size    stage cache (stage_cache), bounded to cache_size bytes
+    contig_cache,            SQLite file of the per-contig annotation cache (annotation_cache),
+    contig_cache_size        bounded to about contig_cache_size bytes
+    """
+    cache = (cache_dir, cache_size, stage_cache.stage_keys(input_file, combine_profiles, staged_search, min_length,
+                                                           max_chromid_length, backend,
+                                                           fixed_domz=bool(contig_cache))) if cache_dir else None
+    contig_cache = (contig_cache, contig_cache_size,
+                    annotation_cache.annotation_version(combine_profiles, staged_search, backend)) \
+        if contig_cache else None
+    work_dir = make_work_dir(scratch_dir)
+    try:
+        return run_stages(input_file, cpu, output_file, dt, work_dir, metric=metric, use_index=use_index, fused=fused,
+                          checkpoint_dir=checkpoint_dir, budget=budget, combine_profiles=combine_profiles,
+                          staged_search=staged_search, backend=backend, min_length=min_length,
+                          max_chromid_length=max_chromid_length, cache=cache, contig_cache=contig_cache)
+    finally:
+        if not keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_stages(input_file, cpu, output_file, dt, work_dir, *, metric, use_index, fused, checkpoint_dir, budget,
+               combine_profiles, staged_search, backend, min_length, max_chromid_length, cache, contig_cache):
+    """
+    Runs the stages of run_pipeline() with external tool files in work_dir. cache and
+    contig_cache are (location, size, keys or version) tuples, or None when disabled.
+    """
+    # Python 阶段的进程池大小；共享预算下按样本并发数分配，并从预算中占用相应线程
+    stage_cpu = budget['stage_cpu'] if budget else cpu
+    mp_context = part1.budget_mp_context(budget)
+    index = part0.build_index(input_file)
+    gc_table = generate_gc_table(index)
+    write_checkpoint(checkpoint_dir, "gc.npz", part0.write_gc_table, gc_table)
+    gene_index = part0.filter_index(index, min_length) if min_length else None
+
+    # 按 contig 缓存时，只对缓存中没有的序列做基因预测与标记基因搜索
+    annotated = index if gene_index is None else gene_index
+    contig_hashes = annotation_cache.sequence_hashes(input_file, annotated) if contig_cache else None
+
+    def run_markers():
+        if contig_cache is None:
+            return find_markers(input_file, cpu, combine_profiles, work_dir, budget, staged_search, gene_index, backend)
+        cache_file, cache_size, version = contig_cache
+        return annotation_cache.cached_annotation(
+            cache_file, version, contig_hashes, annotated,
+            lambda misses: find_markers(input_file, cpu, combine_profiles, work_dir, budget, staged_search, misses,
+                                        backend, fixed_domz=True), cache_size)
+    hits = cached_stage(cache, 'markers', run_markers,
+                        lambda hits, path: part1.write_hits(hits, os.path.join(path, "part1.txt")),
+                        lambda path: part1.read_hits(os.path.join(path, "part1.txt")), stream=True)
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        hits = part1.record_hits(hits, os.path.join(checkpoint_dir, "part1.txt"))
+
+    candidates = prescreen(hits)
+    if max_chromid_length is not None:
+        lengths = {record.seq_id: record.seq_length for record in index}
+        candidates = part2.drop_long_chromids(candidates, lengths, max_chromid_length)
+    write_checkpoint(checkpoint_dir, "part2.txt", part2.write_candidates, candidates)
+
+    def run_tnf():
+        with part1.reserved_threads(budget, stage_cpu):
+            if contig_cache is None:
+                return compute_tnf(input_file, stage_cpu, candidates, index, mp_context)
+            cache_file, cache_size, _ = contig_cache
+            return annotation_cache.cached_tnf(cache_file, contig_hashes, candidates,
+                                               lambda ids: compute_tnf(input_file, stage_cpu, ids, index, mp_context),
+                                               cache_size)
+    tnf = cached_stage(cache, 'tnf', run_tnf,
+                       lambda tnf, path: part3.write_tnf_store(os.path.join(path, "part3.tnf"), *tnf),
+                       lambda path: part3.load_tnf_store(os.path.join(path, "part3.tnf")))
+    write_checkpoint(checkpoint_dir, "part3.tnf", lambda store, path: part3.write_tnf_store(path, *store), tnf)
+
+    thresholds = part5.as_thresholds(dt)
+    if fused:
+        with part1.reserved_threads(budget, stage_cpu):
+            results = cluster_and_sweep(gc_table, candidates, tnf, stage_cpu, thresholds, metric, use_index, mp_context)
+    else:
+        clusters = cached_stage(cache, 'clusters', lambda: build_clusters(gc_table, candidates),
+                                lambda clusters, path: part4.save_cluster_ranges(clusters, os.path.join(path, "part4.npz")),
+                                lambda path: part4.load_cluster_ranges(os.path.join(path, "part4.npz")))
+        write_checkpoint(checkpoint_dir, "part4.npz", part4.write_clusters, clusters)
+        with part1.reserved_threads(budget, stage_cpu):
+            results = sweep_clusters(clusters, tnf, candidates, stage_cpu, thresholds, metric, use_index, mp_context)
+    part5.write_results(results, output_file)
+    return results
+
+# 批量模式：清单中的每行是 "样本名<TAB>FASTA路径" 或只有 FASTA 路径（样本名取文件名），# 开头为注释
+def read_manifest(manifest_file):
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    samples = []
+    with open(manifest_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            input_file = os.path.join(base_dir, fields[-1])
+            name = fields[0] if len(fields) > 1 else os.path.splitext(os.path.basename(input_file))[0]
+            samples.append((name, input_file))
+
+    names = [name for name, _ in samples]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate sample names in {manifest_file}: {', '.join(duplicates)}")
+    return samples
+
+def run_sample(name, input_file, output_dir, cpu, dt, budget, checkpoint_dir=None, **options):
+    """Runs one batch sample; returns its summary row (failures are recorded, not raised)."""
+    output_file = os.path.join(output_dir, f"{name}.txt")
+    sample_checkpoint_dir = os.path.join(checkpoint_dir, name) if checkpoint_dir else None
+    start = time.perf_counter()
+    try:
+        results = run_pipeline(input_file, cpu, output_file, dt, checkpoint_dir=sample_checkpoint_dir, budget=budget,
+                               **options)
+        (clusters,) = results.values()
+        status, chromosomes, chromids = "ok", len(clusters), sum(len(cluster) - 1 for cluster in clusters)
+    except (Exception, SystemExit) as e:
+        print(f"[Note] Sample {name} failed: {e!r}")
+        status, chromosomes, chromids, output_file = "failed", 0, 0, ""
+    return name, input_file, status, chromosomes, chromids, time.perf_counter() - start, output_file
+
+def write_summary(rows, summary_file):
+    with open(summary_file, 'w') as f:
+        f.write("sample\tinput\tstatus\tchromosomes\tchromids\tseconds\toutput\n")
+        for name, input_file, status, chromosomes, chromids, seconds, output_file in rows:
+            f.write(f"{name}\t{input_file}\t{status}\t{chromosomes}\t{chromids}\t{seconds:.1f}\t{output_file}\n")
+    print(f"[Note] Batch summary written to {summary_file}")
+
+def run_batch(manifest_file, cpu, output_dir, dt, parallel_samples=None, **options):
+    """
+    Runs every sample of the manifest in one process. Up to parallel_samples samples are
+    in flight at once, and all their prodigal/hmmsearch/KofamScan jobs and Python stages
+    draw threads from a single cpu budget. Writes <output_dir>/<sample>.txt per sample and
+    <output_dir>/summary.tsv; returns the summary rows in manifest order.
+    """
+    if len(part5.as_thresholds(dt)) > 1:
+        raise ValueError("A -d threshold sweep is not supported in batch mode")
+    samples = read_manifest(manifest_file)
+    if not samples:
+        raise ValueError(f"No samples in {manifest_file}")
+    parallel_samples = max(1, min(len(samples), parallel_samples or cpu // 2))
+    # 样本在同一进程中以线程并发运行：在多线程进程中 fork 可能使子进程死锁，并会复制其它样本的内存数据，
+    # 因此各阶段的子进程改由 forkserver 启动
+    budget = part1.make_budget(cpu, stage_cpu=max(1, cpu // parallel_samples),
+                               mp_context=multiprocessing.get_context("forkserver"))
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"[Note] Batch of {len(samples)} samples, {parallel_samples} in flight, {cpu} threads in total")
+
+    with ThreadPoolExecutor(max_workers=parallel_samples) as executor:
+        rows = list(executor.map(lambda sample: run_sample(*sample, output_dir, cpu, dt, budget, **options), samples))
+
+    write_summary(rows, os.path.join(output_dir, "summary.tsv"))
+    return rows
@@ -0,0 +1,113 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+from part1 import MARKER_PROFILES, database_file
+
+# 阶段缓存：每个阶段的输出保存在 <cache_dir>/<stage>-<key>/ 下，key 由输入文件内容、
+# 数据库文件内容与阶段参数的哈希得到；输入或数据库变化后自动失效。
+# 条目先写入临时目录再改名，命中时更新修改时间，超过容量时按最久未使用淘汰。
+
+# 缓存格式或阶段语义变化时递增，使旧条目全部失效
+CACHE_VERSION = 3
+
+def file_digest(path, chunk_size=1024**2):
+    """文件内容的 SHA-256；文件不存在时返回 'missing'"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return 'missing'
+    return digest.hexdigest()
+
+def database_files():
+    """标记基因搜索用到的数据库文件：各 HMM、ko_list、dnaa.hal 及其列出的 profile"""
+    files = [database_file(f"{profile}.hmm") for _, profiles in MARKER_PROFILES for profile in profiles]
+    files += [database_file("ko_list"), database_file("dnaa.hal")]
+    try:
+        with open(database_file("dnaa.hal"), 'r') as f:
+            files += [os.path.join(os.path.dirname(database_file("dnaa.hal")), line.strip()) for line in f if line.strip()]
+    except FileNotFoundError:
+        pass
+    return files
+
+def stage_key(*parts):
+    return hashlib.sha256("\t".join(str(part) for part in (CACHE_VERSION,) + parts).encode()).hexdigest()[:32]
+
+def stage_keys(input_file, combine_profiles=False, staged_search=False, min_length=0, max_chromid_length=None,
+               backend="subprocess", fixed_domz=False):
+    """
+    返回各可缓存阶段的 key：markers（part1 命中记录）、tnf（part3 矩阵）、clusters（part4 区间）。
+    part2 由命中记录直接得到，part5 依赖 -d 与距离度量，每次都重新计算。
+    fixed_domz 表示标记基因搜索使用 domZ=1（按 contig 缓存注释时）。
+    """
+    input_digest = file_digest(input_file)
+    database_digest = stage_key(*(f"{os.path.basename(path)}:{file_digest(path)}" for path in database_files()))
+    markers = stage_key("markers", input_digest, database_digest, combine_profiles, staged_search, min_length, backend,
+                        fixed_domz)
+    return {
+        'markers': markers,
+        'tnf': stage_key("tnf", input_digest, markers, max_chromid_length),
+        'clusters': stage_key("clusters", input_digest, markers, max_chromid_length),
+    }
+
+def entry_dir(cache_dir, stage, key):
+    return os.path.join(cache_dir, f"{stage}-{key}")
+
+def lookup(cache_dir, stage, key):
+    """返回命中的条目目录（并更新其修改时间），未命中返回 None"""
+    path = entry_dir(cache_dir, stage, key)
+    if not os.path.isdir(path):
+        return None
+    os.utime(path)
+    print(f"[Note] Cache hit for {stage} ({key})")
+    return path
+
+def store(cache_dir, stage, key, writer, max_bytes=None):
+    """writer(条目目录) 写出阶段输出；写完后原子地放入缓存，再按容量淘汰旧条目。返回条目目录"""
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=f".{stage}-", dir=cache_dir)
+    try:
+        writer(temp_dir)
+        os.replace(temp_dir, entry_dir(cache_dir, stage, key))
+    except OSError:
+        # 另一个运行已写入同一条目
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir(cache_dir, stage, key)):
+            raise
+    if max_bytes is not None:
+        evict(cache_dir, max_bytes, keep=entry_dir(cache_dir, stage, key))
+    return entry_dir(cache_dir, stage, key)
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def evict(cache_dir, max_bytes, keep=None):
+    """删除最久未使用的条目，直到缓存总大小不超过 max_bytes（keep 指定的条目不删除）"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and not name.startswith('.'):
+            entries.append((os.path.getmtime(path), directory_size(path), path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        print(f"[Note] Evicted cache entry {os.path.basename(path)} ({size} bytes)")
+    return total
+
+def parse_size(text):
+    """解析 '500M'、'20G' 这样的容量（字节），不带单位时按字节"""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
@@ -0,0 +1,94 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import part1
+from part1 import Hit, iter_domtblout_hits, iter_kofam_hits
+
+# KofamScan -f detail：超过 KO 自身阈值的行以 "*" 开头，得分列随之后移一列
+KOFAM_DETAIL = """\
+#    gene name           KO     thrshld  score   E-value KO definition
+#-------------------- ------ ------- ------ --------- ---------------------
+* contig1_3            K02313  127.57  450.2  1.2e-135 chromosomal replication initiator protein
+  contig1_3            K10763  171.63  120.5   3.4e-35 DnaA-homolog protein
+  contig2_1            K02313  127.57   99.9   2.1e-27 chromosomal replication initiator protein
+* contig_with_underscores_12 K10763  171.63  180.0   5.0e-52 DnaA-homolog protein
+  contig3_2            K99999       -  100.0   1.0e-28 KO without a threshold
+"""
+
+
+def test_kofam_detail_score_column(tmp_path):
+    detail = tmp_path / "kofam.txt"
+    detail.write_text(KOFAM_DETAIL)
+
+    assert list(iter_kofam_hits(str(detail))) == [
+        Hit("contig1", 3, "dnaa", 450.2),
+        Hit("contig1", 3, "dnaa", 120.5),
+        Hit("contig_with_underscores", 12, "dnaa", 180.0),
+        Hit("contig3", 2, "dnaa", 100.0),
+    ]
+    assert [hit.score for hit in iter_kofam_hits(str(detail), threshold=0)] == [450.2, 120.5, 99.9, 180.0, 100.0]
+
+
+pyhmmer = pytest.importorskip("pyhmmer")
+
+
+def consensus_proteins():
+    """Proteins built from the consensus of the shipped profiles, named like prodigal output."""
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    hmm_files = part1.family_hmm_files("par") + part1.kofam_profiles(part1.database_file("dnaa.hal"))
+    consensus = [hmm.consensus.upper() for hmm_file in hmm_files for hmm in part1.load_hmms(hmm_file)]
+    sequences = []
+    for n, sequence in enumerate(consensus):
+        sequences.append(sequence)
+        # 截短的序列得分更低，两份拷贝拼接的序列产生多个结构域
+        sequences.append(sequence[: len(sequence) // 3])
+        if n % 4 == 0:
+            sequences.append(sequence + sequence)
+    proteins = [pyhmmer.easel.TextSequence(name=f"contig{n // 3}_{n % 3 + 1}", sequence=sequence).digitize(alphabet)
+                for n, sequence in enumerate(sequences)]
+    return pyhmmer.easel.DigitalSequenceBlock(alphabet, proteins)
+
+
+@pytest.mark.parametrize("dom_z", [None, 1])
+def test_search_block_hits_match_domtblout(tmp_path, dom_z):
+    hmm_files = part1.family_hmm_files("par")
+    proteins = consensus_proteins()
+
+    # 同一搜索由 pyhmmer 写出的 --domtblout 表格，按 subprocess 后端的方式解析
+    domtblout = tmp_path / "par.domtblout"
+    options = {"domZ": dom_z} if dom_z is not None else {}
+    hmms = [hmm for hmm_file in hmm_files for hmm in part1.load_hmms(hmm_file)]
+    with open(domtblout, "wb") as f:
+        for n, top_hits in enumerate(pyhmmer.hmmer.hmmsearch(hmms, proteins, cpus=1, Z=1, domE=1e-5, **options)):
+            top_hits.write(f, format="domains", header=n == 0)
+    expected = list(iter_domtblout_hits(str(domtblout), "par"))
+
+    assert expected
+    assert list(part1.search_block_hits(hmm_files, "par", proteins, 1, dom_z=dom_z)) == expected
+
+
+def test_kofam_block_hits_score_type(tmp_path):
+    proteins = consensus_proteins()
+    ko_list = part1.read_ko_list(part1.database_file("ko_list"))
+
+    # KofamScan 读取 hmmsearch --tblout：score_type 为 "domain" 时用最佳结构域得分（第 9 列），否则用全序列得分（第 6 列）
+    expected = []
+    for hmm_file in part1.kofam_profiles(part1.database_file("dnaa.hal")):
+        knum = os.path.splitext(os.path.basename(hmm_file))[0]
+        score_index = 8 if ko_list[knum][1] == "domain" else 5
+        tblout = tmp_path / f"{knum}.tblout"
+        with open(tblout, "wb") as f:
+            for top_hits in pyhmmer.hmmer.hmmsearch(part1.load_hmms(hmm_file), proteins, cpus=1):
+                top_hits.write(f, format="targets")
+        with open(tblout) as f:
+            rows = [line.split() for line in f if not line.startswith("#")]
+        expected += [Hit(*part1.parse_protein_id(row[0]), "dnaa", float(row[score_index]))
+                     for row in rows if float(row[score_index]) >= 0]
+
+    assert any(ko_list[knum][1] == "domain" for knum in ko_list)
+    assert expected
+    assert list(part1.kofam_block_hits(proteins, 1, threshold=0)) == expected
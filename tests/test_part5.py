@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from part4 import write_clusters
+from part5 import clusters_from_lists, load_clusters, schedule_cluster_chunks, sweep_clusters, sweep_output_file
+
+
+def make_clusters(count, seed=0):
+    """count clusters with 0-5 members each; every member's TNF vector equals its chromosome's."""
+    rng = np.random.default_rng(seed)
+    cluster_lists, ids, rows = [], [], []
+    for i in range(count):
+        cluster = [f"chr{i}"] + [f"member{i}_{j}" for j in range(rng.integers(0, 6))]
+        centre = rng.random(256).astype(np.float32) + 0.5
+        cluster_lists.append(cluster)
+        ids.extend(cluster)
+        rows.extend([centre] * len(cluster))
+    return cluster_lists, clusters_from_lists(cluster_lists), (ids, np.array(rows))
+
+
+# 聚类数不能被 cpu 整除时，旧版 grouper 会丢掉尾部的聚类
+@pytest.mark.parametrize("count, cpu", [(1, 4), (13, 4), (17, 3), (100, 7), (101, 8)])
+def test_chunks_cover_every_cluster_once(count, cpu):
+    _, clusters, _ = make_clusters(count)
+    chunks = schedule_cluster_chunks(clusters, cpu)
+    covered = sorted(index for start, end in chunks for index in range(start, end))
+    assert covered == list(range(count))
+
+
+# 经 part4 写出的 part4.txt 读回后评分：聚类数不能被 cpu 整除时也要评估全部聚类
+@pytest.mark.parametrize("count, cpu", [(13, 4), (17, 3), (101, 8)])
+def test_every_cluster_is_scored(tmp_path, capsys, count, cpu):
+    cluster_lists, clusters, tnf = make_clusters(count)
+    dnaa_sequences = {cluster[0] for cluster in cluster_lists}
+    part4_file = str(tmp_path / "part4.txt")
+    write_clusters(clusters, part4_file, cpu)
+
+    results = sweep_clusters(load_clusters(part4_file), tnf, dnaa_sequences, cpu, (0.5,))
+
+    assert f"Evaluated {count} clusters" in capsys.readouterr().out
+    expected = [cluster for cluster in cluster_lists if len(cluster) > 1]
+    assert results[0.5] == expected
+
+
+# :g 只保留 6 位有效数字，相近的阈值会写到同一个文件
+def test_sweep_output_files_are_distinct():
+    thresholds = (1.0, 1.6, 1.6000001, 1.60000001, 2.5)
+    files = [sweep_output_file("out.txt", dt) for dt in thresholds]
+    assert files[:2] == ["out.d1.txt", "out.d1.6.txt"]
+    assert len(set(files)) == len(thresholds)